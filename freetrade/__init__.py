@@ -1,6 +1,47 @@
-from .credentials import Credentials
-from .auth import Auth
-from .api import API
-from .index import Index
-from .datastore import DataStore
-from .freetrade import FreeTrade
+import importlib
+
+# public names -> submodules, which are imported on first access (PEP 562),
+# so that `import freetrade` does not import requests, numpy or pandas
+_exports = {
+    'Instrumentation': 'instrumentation',
+    'MetricsCollector': 'instrumentation',
+    'StatsdExporter': 'instrumentation',
+    'RateLimiter': 'ratelimit',
+    'create_session': 'session',
+    'CsvStorage': 'storage',
+    'BinaryStorage': 'storage',
+    'ShardedStorage': 'storage',
+    'DerivedStore': 'derived',
+    'HistoryCache': 'cache',
+    'Asset': 'catalogue',
+    'Catalogue': 'catalogue',
+    'Changes': 'snapshot',
+    'Snapshot': 'snapshot',
+    'Credentials': 'credentials',
+    'TokenStore': 'tokenstore',
+    'Auth': 'auth',
+    'AuthPool': 'authpool',
+    'API': 'api',
+    'Index': 'index',
+    'DataStore': 'datastore',
+    'Analytics': 'analytics',
+    'FreeTrade': 'freetrade',
+    'ExchangeCalendar': 'calendars',
+    'RefreshScheduler': 'scheduler',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name not in _exports:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    value = getattr(importlib.import_module('.' + _exports[name], __name__), name)
+    # later lookups do not go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted(set(globals()) | set(__all__))
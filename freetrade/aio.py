@@ -0,0 +1,165 @@
+import asyncio
+from collections import OrderedDict
+from datetime import date
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .api import API, get_history_start_date, get_history_duration, check_history, format_history
+from .auth import Auth
+from .catalogue import Catalogue
+from .index import Index
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def create_async_session(limit: int = 100, limit_per_host: int = 10) -> 'aiohttp.ClientSession':
+    # limit: number of the pooled connections, limit_per_host: to one host
+    if aiohttp is None:
+        raise ImportError('aiohttp is required for the async client: pip install freetrade[async]')
+
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(connector=connector)
+
+
+class AsyncAuth:
+    def __init__(self, auth: Auth, session: 'aiohttp.ClientSession'):
+        self.auth = auth
+        self.session = session
+        self.lock = asyncio.Lock()
+
+    async def refresh_id_token(self):
+        url, data = self.auth.get_refresh_id_token_request()
+        async with self.session.post(url, data=data) as res:
+            self.auth.set_refreshed_tokens(await res.json(content_type=None))
+
+    async def keep_id_token_valid(self):
+        if not self.auth.authenticated:
+            # a lazy auth logs in on first use, which may block on the OTP
+            await asyncio.get_running_loop().run_in_executor(None, self.auth.ensure_authenticated)
+
+        if self.auth.tokens.is_valid():
+            return
+
+        async with self.lock:
+            # another task may have refreshed the token while waiting for the lock
+            if not self.auth.tokens.is_valid():
+                await self.refresh_id_token()
+
+
+class AsyncClient:
+    def __init__(self, session: 'aiohttp.ClientSession' = None, max_concurrency: int = 32):
+        # the session is created on first use, as it has to be created inside the running event loop
+        self.session = session
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+
+    def get_session(self) -> 'aiohttp.ClientSession':
+        if self.session is None:
+            self.session = create_async_session()
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        self.get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncAPI(AsyncClient):
+    def __init__(self, api: API, session: 'aiohttp.ClientSession' = None, max_concurrency: int = 32):
+        # max_concurrency: number of the requests in flight
+        super().__init__(session, max_concurrency)
+        self.api = api
+        self.auth = None
+
+    def get_session(self) -> 'aiohttp.ClientSession':
+        session = super().get_session()
+        if self.auth is None:
+            self.auth = AsyncAuth(self.api.auth, session)
+        return session
+
+    async def get_json(self, url: str) -> dict or list or None:
+        session = self.get_session()
+        await self.auth.keep_id_token_valid()
+
+        async with self.semaphore:
+            async with session.get(url, headers=self.api.get_request_header()) as response:
+                if response.status != 200:
+                    return None
+                return await response.json(content_type=None)
+
+    async def get_ticker_history_iextrading(self, ticker: str, duration: str = '1m') -> list:
+        return await self.get_json(self.api.get_ticker_history_iextrading_url(ticker, duration))
+
+    async def get_ticker_history_quandl(self, ticker: str, ftexchange: str = 'XLON', start_date: date = None) -> dict:
+        return await self.get_json(self.api.get_ticker_history_quandl_url(ticker, ftexchange, start_date))
+
+    async def get_ticker_history(self, ticker: str, ftexchange: str, duration: str = '1m',
+                                 start_date: date = None,
+                                 output: str = 'dict') -> OrderedDict or np.ndarray or 'pd.Series':
+        if ftexchange == 'XLON':
+            history_date = get_history_start_date(duration, start_date)
+            history = await self.get_ticker_history_quandl(ticker, ftexchange, history_date)
+            data = self.api.parse_ticker_history_quandl(check_history(history, ticker))
+        else:
+            history = await self.get_ticker_history_iextrading(ticker, get_history_duration(duration, start_date))
+            data = self.api.parse_ticker_history_iextrading(check_history(history, ticker))
+
+        return format_history(data, output, ticker)
+
+    async def get_ticker_histories(self, tickers: list, duration: str = '1m', start_date: date = None,
+                                   output: str = 'dict') -> dict:
+        # tickers: list of (ticker, ftexchange), returns ticker -> prices or the raised exception
+        results = await asyncio.gather(*(self.get_ticker_history(ticker, ftexchange, duration, start_date, output)
+                                         for ticker, ftexchange in tickers), return_exceptions=True)
+        return OrderedDict(zip((ticker for ticker, _ in tickers), results))
+
+
+class AsyncIndex(AsyncClient):
+    def __init__(self, index: Index, session: 'aiohttp.ClientSession' = None):
+        super().__init__(session)
+        self.index = index
+
+    async def get_hits(self, hits_per_page: int = 1000) -> list:
+        session = self.get_session()
+
+        hits = []
+        next_page = (0, None)
+        while next_page is not None:
+            page, cursor = next_page
+            url, headers, data = self.index.get_assets_request_args(hits_per_page, page, cursor=cursor)
+            async with session.get(url, headers=headers, data=data) as r:
+                r.raise_for_status()
+                content = await r.json(content_type=None)
+
+            hits.extend(content['hits'])
+            next_page = self.index.get_next_page(content, page)
+
+        return hits
+
+    async def get_assets(self) -> dict:
+        if len(self.index.assets) > 0:
+            return self.index.assets
+
+        cache = self.index.load_cache()
+        hits = cache['hits'] if self.index.is_cache_fresh(cache) else await self.get_hits()
+        self.index.hits = hits
+        self.index.assets = self.index.build_assets(hits)
+        self.index.catalogue = Catalogue.from_hits(hits)
+        if not self.index.is_cache_fresh(cache):
+            self.index.save_cache(hits)
+        return self.index.assets
@@ -0,0 +1,326 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from datetime import date
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .datastore import DataStore
+from .files import atomic_write
+from .storage import columns_to_array, to_date
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# value: base currency value of the portfolio on each date
+# weights: share of each position in the value, None if not requested
+# returns: daily return of the positions held on the previous date, so that trades are not returns
+Valuation = namedtuple('Valuation', ['value', 'weights', 'returns'])
+
+# the first row of a column without prices
+NEVER = np.iinfo('i8').max
+
+# currencies of the prices quoted in the hundredths of another currency
+MINOR_CURRENCIES = {'GBX': 'GBP', 'GBp': 'GBP'}
+
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    # the missing values (nan) of each column take the last value above them, e.g. on the holidays of an exchange
+    rows = np.where(np.isnan(values), 0, np.arange(len(values))[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return values[rows, np.arange(values.shape[1])]
+
+
+def align_rates(rates: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    # the rate (HISTORY_DTYPE) on or before each date, nan before the first rate
+    rows = np.searchsorted(rates['date'], dates, side='right') - 1
+    aligned = rates['close'][np.maximum(rows, 0)] if len(rates) else np.full(len(dates), np.nan)
+    return np.where(rows >= 0, aligned, np.nan)
+
+
+class Analytics:
+    # the price history of DataStore in one base currency, and the valuation of portfolios on it
+    def __init__(self, datastore: DataStore, base_currency: str = 'GBP', directory: str = 'history',
+                 tickers: list = None, fx_directory: str = None, cache_file: str = None, currencies: dict = None,
+                 pence_exchanges: tuple = ('XLON',), workers: int = 8):
+        # tickers: the columns of the panel, all stored tickers by default
+        # fx_directory: FX rates stored as the history of <CURRENCY><BASE> tickers, by default <directory>/fx,
+        #               e.g. USDGBP is the GBP price of one USD, a stored GBPUSD is inverted, if USDGBP is missing
+        # cache_file: .npz file of the converted panel, so that the next process loads only the new prices
+        # currencies: ticker -> currency, overriding the currency of the catalogue, e.g. {'VUSA': 'GBX'}
+        # pence_exchanges: exchanges quoting the GBP assets in pence, as the catalogue lists their currency as GBP
+        self.datastore = datastore
+        self.base_currency = base_currency
+        self.directory = directory
+        self.universe = None if tickers is None else list(tickers)
+        self.fx_directory = fx_directory if fx_directory is not None else directory + os.sep + 'fx'
+        self.cache_file = cache_file
+        self.currencies = {} if currencies is None else currencies
+        self.pence_exchanges = pence_exchanges
+        self.workers = workers
+
+        # the converted panel: tickers, dates and the (dates, tickers) values in the base currency,
+        # the stored last date of each ticker, and the fingerprint of the conversion, see get_fingerprint
+        self.tickers = None
+        self.dates = None
+        self.values = None
+        self.last_dates = None
+        self.fingerprint = None
+        # the values forward filled, 0 before the first price, and the row of the first price of each column
+        self.filled = None
+        self.first = None
+
+    def get_fx_ticker(self, currency: str) -> str:
+        return currency + self.base_currency
+
+    def save_fx_rates(self, currency: str, dates: list, rates: list):
+        # stores the base currency price of one unit of currency, merged into the stored rates,
+        # the given rates replace the stored ones of the same dates
+        storage = self.datastore.storage
+        ticker = self.get_fx_ticker(currency)
+        data = columns_to_array(dates, rates)
+        if storage.exists(ticker, self.fx_directory):
+            data = np.concatenate((storage.load(ticker, self.fx_directory), data))
+        # the last of the rates of each date
+        data = data[np.argsort(data['date'], kind='stable')]
+        data = data[np.append(data['date'][1:] != data['date'][:-1], True)]
+        storage.write(data, ticker, self.fx_directory, exchange='FX')
+        storage.flush(self.fx_directory)
+        # the panel is converted again with the new rates
+        self.tickers = self.dates = None
+
+    def load_fx_rates(self, currency: str) -> np.ndarray:
+        storage = self.datastore.storage
+        ticker = self.get_fx_ticker(currency)
+        if storage.exists(ticker, self.fx_directory):
+            return storage.load(ticker, self.fx_directory)
+
+        inverse = self.base_currency + currency
+        if storage.exists(inverse, self.fx_directory):
+            rates = storage.load(inverse, self.fx_directory).copy()
+            with np.errstate(divide='ignore'):
+                rates['close'] = 1 / rates['close']
+            return rates
+
+        raise ValueError('No FX rates of {} in {}, see Analytics.save_fx_rates.'.format(ticker, self.fx_directory))
+
+    def get_currencies(self, tickers: list) -> tuple:
+        # (currencies, scales) of the tickers, a price times its scale is in its currency
+        catalogue = self.datastore.index.get_catalogue()
+        currencies = []
+        scales = np.ones(len(tickers))
+        missing = []
+        for column, ticker in enumerate(tickers):
+            asset = catalogue.get_by_symbol(ticker)
+            currency = self.currencies.get(ticker) or (asset.currency if asset is not None else None)
+            if currency is None:
+                missing.append(ticker)
+                continue
+
+            if currency in MINOR_CURRENCIES:
+                currency = MINOR_CURRENCIES[currency]
+                scales[column] = 0.01
+            elif currency == 'GBP' and ticker not in self.currencies and asset.exchange in self.pence_exchanges:
+                scales[column] = 0.01
+            currencies.append(currency)
+
+        if missing:
+            raise ValueError('Unknown currency of {}, see the currencies of Analytics.'.format(', '.join(missing)))
+        return currencies, scales
+
+    def convert(self, dates: np.ndarray, values: np.ndarray, tickers: list) -> np.ndarray:
+        # (dates, tickers) prices in the base currency, one multiplication by the rate of each column on each date
+        # raises ValueError, if a price has no FX rate on or before its date, instead of valuing it as nothing
+        currencies, scales = self.get_currencies(tickers)
+        unique, columns = np.unique(np.array(currencies, dtype=str), return_inverse=True)
+        columns = columns.reshape(-1)
+        priced = ~np.isnan(values)
+        rates = np.empty((len(dates), len(unique)))
+        for column, currency in enumerate(unique):
+            if currency == self.base_currency:
+                rates[:, column] = 1.0
+                continue
+
+            rates[:, column] = align_rates(self.load_fx_rates(currency), dates)
+            missing = np.isnan(rates[:, column]) & priced[:, columns == column].any(axis=1)
+            if missing.any():
+                raise ValueError('No FX rate of {} on {}, see Analytics.save_fx_rates.'.format(
+                    self.get_fx_ticker(currency), dates[missing][0]))
+        return values * rates[:, columns] * scales
+
+    def get_fingerprint(self) -> str:
+        # the base currency, the overrides of the currencies and the hash of each stored FX series,
+        # a cached panel converted with a different one is converted again
+        storage = self.datastore.storage
+        fx = {ticker: hashlib.sha1(np.ascontiguousarray(storage.load(ticker, self.fx_directory)).tobytes()).hexdigest()
+              for ticker in storage.get_tickers(self.fx_directory)}
+        return json.dumps({
+            'base_currency': self.base_currency,
+            'currencies': self.currencies,
+            'pence_exchanges': list(self.pence_exchanges),
+            'fx': fx
+        }, sort_keys=True)
+
+    def get_last_dates(self, tickers: list) -> np.ndarray:
+        # the stored last date of each ticker, NaT without a stored history
+        storage = self.datastore.storage
+        return np.array([storage.get_last_date(ticker, self.directory) if storage.exists(ticker, self.directory)
+                         else None for ticker in tickers], dtype='M8[D]')
+
+    def load_cache(self, tickers: list, fingerprint: str) -> bool:
+        # loads the converted panel of the cache file, if it is of the same tickers and fingerprint
+        if self.cache_file is None or not os.path.isfile(self.cache_file):
+            return False
+        with np.load(self.cache_file) as cache:
+            if 'fingerprint' not in cache or str(cache['fingerprint']) != fingerprint or \
+                    cache['tickers'].tolist() != tickers:
+                return False
+            self.tickers, self.fingerprint = tickers, fingerprint
+            self.dates, self.values, self.last_dates = cache['dates'], cache['values'], cache['last_dates']
+        self.fill(0)
+        return True
+
+    def save_cache(self):
+        atomic_write(self.cache_file, 'wb', lambda f: np.savez(
+            f, fingerprint=self.fingerprint, tickers=np.array(self.tickers, dtype=str),
+            dates=self.dates, values=self.values, last_dates=self.last_dates))
+
+    def fill(self, start: int):
+        # forward fills the values from the row start, continuing the filled rows before it
+        values = self.values[start:]
+        if start > 0:
+            previous = np.where(self.first < start, self.filled[start - 1], np.nan)
+            values = np.concatenate((previous[None], values))
+        filled = forward_fill(values)[1 if start > 0 else 0:]
+
+        priced = ~np.isnan(filled)
+        first = np.full(filled.shape[1], NEVER)
+        if len(filled):
+            first = np.where(priced.any(axis=0), priced.argmax(axis=0) + start, NEVER)
+        self.first = first if start == 0 else np.where(self.first < start, self.first, first)
+        self.filled = np.concatenate((self.filled[:start], np.nan_to_num(filled))) if start > 0 else \
+            np.nan_to_num(filled)
+
+    def update(self) -> int:
+        # brings the converted panel up to date, returns the number of the loaded dates
+        # the dates from the earliest cached last date of the tickers with new prices are loaded again,
+        # so that a backfilled ticker behind the others is complete, nothing is loaded without new prices
+        # a different set of tickers (e.g. a new stored ticker) or fingerprint converts the whole history again
+        tickers = self.datastore.storage.get_tickers(self.directory) if self.universe is None else self.universe
+        fingerprint = self.get_fingerprint()
+        if (self.tickers != tickers or self.fingerprint != fingerprint) and not self.load_cache(tickers, fingerprint):
+            self.tickers, self.fingerprint = tickers, fingerprint
+            self.dates, self.values = np.empty(0, dtype='M8[D]'), np.empty((0, len(tickers)))
+            self.last_dates = np.full(len(tickers), np.datetime64('NaT'), dtype='M8[D]')
+            self.fill(0)
+
+        last_dates = self.get_last_dates(tickers)
+        changed = (last_dates != self.last_dates) & ~(np.isnat(last_dates) & np.isnat(self.last_dates))
+        if not changed.any():
+            return 0
+
+        # a ticker without a cached history may have prices of any date
+        start = None if np.isnat(self.last_dates[changed]).any() else self.last_dates[changed].min()
+        histories = self.datastore.load_histories(self.directory, tickers, start, workers=self.workers)
+        dates, values = DataStore.align_histories(histories)
+
+        keep = 0 if start is None else int(np.searchsorted(self.dates, start))
+        self.dates = np.concatenate((self.dates[:keep], dates))
+        self.values = np.concatenate((self.values[:keep], self.convert(dates, values, tickers)))
+        self.last_dates = last_dates
+        self.fill(keep)
+        if self.cache_file is not None:
+            self.save_cache()
+        return len(dates)
+
+    def ensure_updated(self):
+        # the panel is loaded once, later prices are loaded by update
+        if self.dates is None:
+            self.update()
+
+    def get_panel(self, tickers: list = None, start: str or date = None, end: str or date = None) -> 'pd.DataFrame':
+        # like DataStore.load_historical_data_as_dataframe, in the base currency
+        # tickers: subset of the columns of the panel
+        import pandas as pd
+
+        self.ensure_updated()
+        rows = self.select_rows(start, end)
+        tickers = self.tickers if tickers is None else list(tickers)
+        columns = self.get_columns(tickers)
+        return pd.DataFrame(self.values[rows][:, columns], index=pd.DatetimeIndex(self.dates[rows], name='Date'),
+                            columns=tickers)
+
+    def get_columns(self, tickers: list) -> np.ndarray:
+        columns = {ticker: column for column, ticker in enumerate(self.tickers)}
+        missing = [ticker for ticker in tickers if ticker not in columns]
+        if missing:
+            raise ValueError('No price history of {} in {}.'.format(', '.join(missing), self.directory))
+        return np.array([columns[ticker] for ticker in tickers], dtype='i8')
+
+    def select_rows(self, start: str or date = None, end: str or date = None) -> slice:
+        first = 0 if start is None else np.searchsorted(self.dates, to_date(start), side='left')
+        last = len(self.dates) if end is None else np.searchsorted(self.dates, to_date(end), side='right')
+        return slice(int(first), int(last))
+
+    @staticmethod
+    def get_quantities(positions: dict or 'pd.Series' or 'pd.DataFrame', dates: np.ndarray) -> tuple:
+        # (tickers, quantities) of the positions, a vector of the quantities held throughout,
+        # or (dates, tickers) quantities of a DataFrame of the quantities after the trades on its dates
+        import pandas as pd
+
+        if not isinstance(positions, pd.DataFrame):
+            positions = pd.Series(positions, dtype='f8')
+            return list(positions.index), np.nan_to_num(positions.to_numpy())
+
+        trade_dates = positions.sort_index().index.to_numpy().astype('M8[D]')
+        rows = np.searchsorted(trade_dates, dates, side='right') - 1
+        quantities = np.nan_to_num(positions.sort_index().to_numpy(dtype='f8'))[np.maximum(rows, 0)]
+        quantities[rows < 0] = 0
+        return list(positions.columns), quantities
+
+    def value_portfolio(self, positions: dict or 'pd.Series' or 'pd.DataFrame', start: str or date = None,
+                        end: str or date = None, weights: bool = True) -> Valuation:
+        # positions: ticker -> quantity held throughout, or a DataFrame of the quantities (dates, tickers)
+        # weights: False skips the (dates, positions) weights of a large book
+        # the last price is held over the holidays, a position without a price yet is worth nothing
+        import pandas as pd
+
+        self.ensure_updated()
+        rows = self.select_rows(start, end)
+        dates = self.dates[rows]
+        filled = self.filled[rows]
+        tickers, quantities = self.get_quantities(positions, dates)
+        columns = self.get_columns(tickers)
+
+        if quantities.ndim == 1:
+            # one matrix-vector product over the whole panel, without copying the columns of the positions
+            vector = np.zeros(len(self.tickers))
+            np.add.at(vector, columns, quantities)
+            value = filled @ vector
+            # the value of the previous quantities at the current prices
+            moved = value[1:]
+        else:
+            prices = filled[:, columns]
+            value = np.einsum('ij,ij->i', prices, quantities)
+            moved = np.einsum('ij,ij->i', prices[1:], quantities[:-1])
+
+        returns = np.full(len(dates), np.nan)
+        if len(dates) > 1:
+            # the first price of a position is not a return, as the previous value does not include it
+            first = self.first[columns] - rows.start
+            new = np.flatnonzero((first >= 1) & (first < len(dates)))
+            held = quantities[new] if quantities.ndim == 1 else quantities[first[new] - 1, new]
+            correction = np.bincount(first[new] - 1, weights=filled[first[new], columns[new]] * held,
+                                     minlength=len(dates) - 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                returns[1:] = np.where(value[:-1] != 0, (moved - correction) / value[:-1] - 1, np.nan)
+
+        index = pd.DatetimeIndex(dates, name='Date')
+        if weights:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weights = pd.DataFrame(filled[:, columns] * quantities / value[:, None], index=index, columns=tickers)
+        else:
+            weights = None
+        return Valuation(pd.Series(value, index=index), weights, pd.Series(returns, index=index))
@@ -1,72 +1,157 @@
 import uuid
 from collections import OrderedDict
 from datetime import date
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse
 
+import numpy as np
 import requests
 from dateutil import relativedelta, parser
 
-from . import Auth
+from .auth import Auth
+from .cache import HistoryCache
+from .instrumentation import Instrumentation
+from .session import create_session
+from .storage import array_to_prices, columns_to_array, rows_to_array
+
+# pandas is imported only by the Series and DataFrame outputs
+if TYPE_CHECKING:
+    import pandas as pd
+
+# maximum number of symbols in one IEX trading batch request
+IEX_BATCH_SIZE = 100
+
+# IEX trading chart ranges, from the shortest to the longest
+DURATIONS = OrderedDict([
+    ('1d', relativedelta.relativedelta(days=1)),
+    ('5d', relativedelta.relativedelta(days=5)),
+    ('1m', relativedelta.relativedelta(months=1)),
+    ('3m', relativedelta.relativedelta(months=3)),
+    ('6m', relativedelta.relativedelta(months=6)),
+    ('ytd', relativedelta.relativedelta(month=1, day=1)),
+    ('1y', relativedelta.relativedelta(years=1)),
+    ('2y', relativedelta.relativedelta(years=2)),
+    ('5y', relativedelta.relativedelta(years=5)),
+])
+
+
+def get_duration_start(duration: str, today: date = None) -> date:
+    today = date.today() if today is None else today
+    return today - DURATIONS[duration]
+
+
+def get_covering_duration(start_date: date, today: date = None) -> str:
+    # the smallest duration, whose range starts on or before start_date
+    # '1d' is skipped, as it returns intraday prices
+    covering = [(get_duration_start(duration, today), duration)
+                for duration in DURATIONS if duration != '1d'
+                if get_duration_start(duration, today) <= start_date]
+    return max(covering)[1] if covering else '5y'
+
+
+def get_history_start_date(duration: str, start_date: date = None) -> date:
+    # the start date of Quandl's history
+    if start_date is not None:
+        return start_date
+    if duration in DURATIONS:
+        return get_duration_start(duration)
+    return parser.parse(duration)
+
+
+def get_history_duration(duration: str, start_date: date = None) -> str:
+    # the range of IEX trading's history
+    return duration if start_date is None else get_covering_duration(start_date)
+
+
+def check_history(history: dict or list or None, ticker: str) -> dict or list:
+    # the upstream APIs return None on a failed request
+    if history is None:
+        raise requests.HTTPError(f'Failed to get the history of {ticker}')
+    return history
+
+
+def format_history(data: np.ndarray, output: str = 'dict',
+                   name: str = None) -> OrderedDict or np.ndarray or 'pd.Series':
+    if output == 'dict':
+        return array_to_prices(data)
+    if output == 'array':
+        return data
+    if output == 'series':
+        import pandas as pd
+        return pd.Series(data['close'], index=pd.DatetimeIndex(data['date'], name='Date'), name=name)
+    raise ValueError(f'Unknown output: {output}')
+
+
+def format_ohlcv(df: 'pd.DataFrame') -> 'pd.DataFrame':
+    import pandas as pd
+    if 'date' in df.columns:
+        df.index = pd.DatetimeIndex(df.pop('date'), name='Date')
+    return df
 
 
 class API:
-    def __init__(self, auth: Auth, host: str, useragent: str = None):
+    def __init__(self, auth: Auth, host: str, useragent: str = None, session: requests.Session = None,
+                 cache: HistoryCache = None, instrumentation: Instrumentation = None):
         self.auth = auth
-        self.host = 'https://' + host
+        # optional cache of the price history
+        self.cache = cache
+        self.session = session if session is not None else create_session(instrumentation=instrumentation)
+        # host may include a scheme, e.g. http://localhost:8080 for a local stub server
+        self.host = host if '://' in host else 'https://' + host
+        host = urlparse(self.host).netloc
         self.useragent = useragent if useragent else 'Freetrade/1.0.4756-4756 Dalvik/2.1.0 ' \
                                                      '(Linux; U; Android 9; SM-G965U Build/PPR1.180610.011)'
-        session_id = auth.headers['session_id']
 
+        # Authorization and session_id are set per request, as auth may not have authenticated yet
         self.headers = OrderedDict([
-            ('Authorization', self.auth.get_auth_bearer()),
-            ('session_id', session_id),
+            ('Authorization', ''),
+            ('session_id', ''),
             ('request_id', ''),
             ('User-Agent', self.useragent),
             ('Host', host),
-            ('Connection', 'close'),
             ('Accept-Encoding', 'gzip, deflate')
         ])
 
     def get_request_header(self) -> OrderedDict:
-        self.headers['request_id'] = str(uuid.uuid4())
-        return self.headers
+        # copy, so that concurrent requests do not share a request_id
+        headers = self.headers.copy()
+        # the current bearer, shared by all requests
+        headers['Authorization'] = self.auth.get_valid_auth_bearer()
+        headers['session_id'] = self.auth.headers['session_id']
+        headers['request_id'] = str(uuid.uuid4())
+        return headers
 
     def get_address_by_postcode(self, postcode: str) -> dict:
-        self.auth.keep_id_token_valid()
         headers = self.get_request_header()
 
-        response = requests.get(self.host + '/proxy/postcodelookup/uk/' + postcode, headers=headers)
+        response = self.session.get(self.host + '/proxy/postcodelookup/uk/' + postcode, headers=headers)
 
         return response.json()
 
     def validate_bank(self, sort_code: str, account_number: str) -> dict:
         # sort code is a 6 digit string without hyphens
-        self.auth.keep_id_token_valid()
         headers = self.get_request_header()
         url = f'{self.host}/proxy/bankvalidation/sortCode/{sort_code}/account/{account_number}'
-        response = requests.get(url, headers=headers)
+        response = self.session.get(url, headers=headers)
 
         return response.json()
 
     def withdraw_funds(self, account_id: str, amount: str) -> requests.Response:
-        self.auth.keep_id_token_valid()
-
         url = self.host + '/banking/withdraw-funds'
         payload = {
             'account_id': account_id,
             'amount': amount  # e.g. '1.00'
         }
-        res = requests.post(url, json=payload, headers=self.get_request_header())
+        res = self.session.post(url, json=payload, headers=self.get_request_header())
 
         return res
 
     def set_active_account(self, client_id: str, account_id: str) -> requests.Response:
-        self.auth.keep_id_token_valid()
-
         url = self.host + '/clients/{}/set-active-account'.format(client_id)
         payload = {
             'account_id': account_id
         }
-        res = requests.post(url, json=payload, headers=self.get_request_header())
+        res = self.session.post(url, json=payload, headers=self.get_request_header())
 
         return res
 
@@ -74,8 +159,6 @@ class API:
                      nationality: str, ni_number: str, number: str, premise: str, street: str,
                      post_town: str, county: str, postcode: str, country: str, account_type: str,
                      base_currency: str) -> requests.Response:
-        self.auth.keep_id_token_valid()
-
         url = self.host + '/clients/client-onboard-requests'
 
         payload = {
@@ -99,63 +182,139 @@ class API:
             'account_type': account_type,  # GIA or ... ISA?
             'base_currency': base_currency
         }
-        res = requests.post(url, json=payload, headers=self.get_request_header())
+        res = self.session.post(url, json=payload, headers=self.get_request_header())
 
         return res
 
-    def get_ticker_history_iextrading(self, ticker: str, duration: str = '1m') -> dict:
+    def get_ticker_history_iextrading_url(self, ticker: str, duration: str = '1m') -> str:
         # Does not support securities from LSE (London Stock Exchange)
 
         # FreeTrade uses API from IEX trading to get price history
         # https://iextrading.com/developer/docs/#chart
-        # duration: 5y, 2y, 1y, ytd, 6m, 3m, 1m, 1d
-        url = f'{self.host}/proxy/iex/v1/stock/{ticker}/chart/{duration}'
+        # duration: 5y, 2y, 1y, ytd, 6m, 3m, 1m, 5d, 1d
+        return f'{self.host}/proxy/iex/v1/stock/{ticker}/chart/{duration}'
 
-        response = requests.get(url, headers=self.get_request_header())
+    def get_ticker_history_iextrading(self, ticker: str, duration: str = '1m') -> dict:
+        url = self.get_ticker_history_iextrading_url(ticker, duration)
+
+        response = self.session.get(url, headers=self.get_request_header())
 
         return None if response.status_code != 200 else response.json()
 
-    def get_ticker_history_quandl(self, ticker: str, ftexchange: str = 'XLON', start_date: date = None) -> dict:
+    def get_ticker_history_iextrading_batch_url(self, tickers: list, duration: str = '1m') -> str:
+        # https://iextrading.com/developer/docs/#batch-requests
+        symbols = ','.join(tickers)
+        return f'{self.host}/proxy/iex/v1/stock/market/batch?symbols={symbols}&types=chart&range={duration}'
+
+    def get_ticker_history_iextrading_batch(self, tickers: list, duration: str = '1m') -> dict:
+        # returns ticker -> {'chart': [...]} for up to IEX_BATCH_SIZE tickers
+        url = self.get_ticker_history_iextrading_batch_url(tickers, duration)
+
+        response = self.session.get(url, headers=self.get_request_header())
+
+        return None if response.status_code != 200 else response.json()
+
+    def get_ticker_histories_iextrading(self, tickers: list, duration: str = '1m', start_date: date = None,
+                                        output: str = 'dict', batch_size: int = IEX_BATCH_SIZE) -> OrderedDict:
+        # the history of many non XLON tickers with one request per batch_size tickers
+        # returns ticker -> prices, the tickers missing from the response (e.g. unknown to IEX trading) are left out
+        duration = get_history_duration(duration, start_date)
+
+        histories = OrderedDict()
+        for i in range(0, len(tickers), batch_size):
+            batch = tickers[i:i + batch_size]
+            response = self.get_ticker_history_iextrading_batch(batch, duration)
+            if response is None:
+                raise requests.HTTPError(f'Failed to get the history of {len(batch)} tickers from IEX trading')
+
+            for ticker in batch:
+                if ticker in response:
+                    history = response[ticker].get('chart', [])
+                    histories[ticker] = format_history(self.parse_ticker_history_iextrading(history), output, ticker)
+
+        return histories
+
+    def get_ticker_history_quandl_url(self, ticker: str, ftexchange: str = 'XLON', start_date: date = None,
+                                      column_index: int or None = 4) -> str:
+        # column_index: 4 for the closing price only, None for all the columns
         if start_date is None:
             start_date = date.today() - relativedelta.relativedelta(months=1)
 
         start_date_str = start_date.strftime('%Y-%m-%d')
         symbol = ticker.replace('.', '_')
+        columns = '' if column_index is None else f'column_index={column_index}&'
+
+        return f'{self.host}/proxy/quandl/v3/datasets/{ftexchange}/{symbol}/data.json?' \
+            f'{columns}order=asc&start_date={start_date_str}'
 
-        url = f'{self.host}/proxy/quandl/v3/datasets/{ftexchange}/{symbol}/data.json?' \
-            f'column_index=4&order=asc&start_date={start_date_str}'
+    def get_ticker_history_quandl(self, ticker: str, ftexchange: str = 'XLON', start_date: date = None,
+                                  column_index: int or None = 4) -> dict:
+        url = self.get_ticker_history_quandl_url(ticker, ftexchange, start_date, column_index)
 
-        response = requests.get(url, headers=self.get_request_header())
+        response = self.session.get(url, headers=self.get_request_header())
 
         return None if response.status_code != 200 else response.json()
 
-    def get_ticker_history(self, ticker: str, ftexchange: str, duration: str = '1m') -> OrderedDict:
-        # duration: 5y, 2y, 1y, ytd, 6m, 3m, 1m, 1d
+    @staticmethod
+    def parse_ticker_history_quandl(history: dict) -> np.ndarray:
+        return rows_to_array(history['dataset_data']['data'])
+
+    @staticmethod
+    def parse_ticker_history_iextrading(history: list) -> np.ndarray:
+        return columns_to_array([price['date'] for price in history],
+                                [price['close'] for price in history])
+
+    @staticmethod
+    def parse_ticker_ohlcv_quandl(history: dict) -> 'pd.DataFrame':
+        import pandas as pd
+        dataset = history['dataset_data']
+        columns = [column.lower().replace(' ', '_') for column in dataset['column_names']]
+        return format_ohlcv(pd.DataFrame(dataset['data'], columns=columns))
+
+    @staticmethod
+    def parse_ticker_ohlcv_iextrading(history: list) -> 'pd.DataFrame':
+        import pandas as pd
+        return format_ohlcv(pd.DataFrame.from_records(history))
+
+    def get_ticker_history(self, ticker: str, ftexchange: str, duration: str = '1m',
+                           start_date: date = None, output: str = 'dict') -> OrderedDict or np.ndarray or 'pd.Series':
+        # duration: 5y, 2y, 1y, ytd, 6m, 3m, 1m, 5d, 1d
+        # start_date: if given, overrides duration and fetches the prices since start_date
+        # (IEX trading returns the smallest range covering it, thus can include older prices)
+        # output: 'dict', 'array' (with 'date' and 'close' fields) or 'series'
+
+        # intraday prices ('1d') and custom IEX ranges are not cached
+        if self.cache is not None and duration != '1d' and \
+                (ftexchange == 'XLON' or start_date is not None or duration in DURATIONS):
+            history_date = get_history_start_date(duration, start_date)
+            data = self.cache.get_ticker_history(
+                ticker, ftexchange, history_date,
+                lambda since: self.fetch_ticker_history(ticker, ftexchange, start_date=since, output='array'))
+            return format_history(data, output, ticker)
+
+        return self.fetch_ticker_history(ticker, ftexchange, duration, start_date, output)
+
+    def fetch_ticker_history(self, ticker: str, ftexchange: str, duration: str = '1m',
+                             start_date: date = None, output: str = 'dict') -> OrderedDict or np.ndarray or 'pd.Series':
+        # same as get_ticker_history, bypassing the cache
 
         if ftexchange == 'XLON':
-            history_date = date.today()
-            delta_times = {
-                '5y': relativedelta.relativedelta(years=5),
-                '2y': relativedelta.relativedelta(years=2),
-                '1y': relativedelta.relativedelta(years=1),
-                'ytd': relativedelta.relativedelta(month=1, day=1),
-                '6m': relativedelta.relativedelta(months=6),
-                '3m': relativedelta.relativedelta(months=3),
-                '1m': relativedelta.relativedelta(months=1),
-                '1d': relativedelta.relativedelta(days=1),
-            }
-            if duration in delta_times:
-                history_date -= delta_times[duration]
-            else:
-                history_date = parser.parse(duration)
-
-            history = self.get_ticker_history_quandl(ticker, ftexchange, history_date)
-
-            data = OrderedDict((history_date, price)
-                               for history_date, price in history['dataset_data']['data'])
+            history_date = get_history_start_date(duration, start_date)
+            history = check_history(self.get_ticker_history_quandl(ticker, ftexchange, history_date), ticker)
+            data = self.parse_ticker_history_quandl(history)
         else:
-            history = self.get_ticker_history_iextrading(ticker, duration)
-            data = OrderedDict((price['date'], price['close'])
-                               for price in history)
+            history = self.get_ticker_history_iextrading(ticker, get_history_duration(duration, start_date))
+            data = self.parse_ticker_history_iextrading(check_history(history, ticker))
 
-        return data
+        return format_history(data, output, ticker)
+
+    def get_ticker_ohlcv(self, ticker: str, ftexchange: str, duration: str = '1m',
+                         start_date: date = None) -> 'pd.DataFrame':
+        # all the columns of the upstream API, e.g. open, high, low, close and volume, indexed by date
+        if ftexchange == 'XLON':
+            history_date = get_history_start_date(duration, start_date)
+            history = self.get_ticker_history_quandl(ticker, ftexchange, history_date, column_index=None)
+            return self.parse_ticker_ohlcv_quandl(check_history(history, ticker))
+
+        history = self.get_ticker_history_iextrading(ticker, get_history_duration(duration, start_date))
+        return self.parse_ticker_ohlcv_iextrading(check_history(history, ticker))
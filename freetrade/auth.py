@@ -1,28 +1,45 @@
 import json
 import logging
 import os
+import threading
 import uuid
 from collections import OrderedDict
-from datetime import datetime
 from typing import Callable
+from urllib.parse import urlparse
 
-import jwt
 import requests
 
-from freetrade import Credentials
+from .credentials import Credentials
+from .instrumentation import Instrumentation, span
+from .session import create_session
+from .tokens import TokenManager
+from .tokenstore import TokenStore
 
 logger = logging.getLogger(__name__)
 
 
 class Auth:
     def __init__(self, credentials: Credentials, email: str, useragent: str = None,
-                 session_id: str = None, otp_parser: Callable = None):
+                 session_id: str = None, otp_parser: Callable = None, session: requests.Session = None,
+                 background_refresh: bool = True, instrumentation: Instrumentation = None,
+                 lazy: bool = False, token_store: TokenStore = None):
+        # lazy: authenticate on the first authenticated call, instead of here
+        # token_store: if given, the session is kept there, instead of ft-session.json
+        self.token_store = token_store
         self.credentials = credentials
+        self.instrumentation = instrumentation
+        self.session = session if session is not None else create_session(instrumentation=instrumentation)
         self.custom_token = None
         self.id_token = None
         self.refresh_token = None
-
-        self.host = 'https://' + self.credentials.get_ft_auth_host()
+        self.authenticated = False
+        self.authenticate_lock = threading.Lock()
+        # caches the expiry of the ID token and refreshes it in the background
+        self.tokens = TokenManager(self.refresh_id_token, background=background_refresh)
+
+        auth_host = self.credentials.get_ft_auth_host()
+        # host may include a scheme, e.g. http://localhost:8080 for a local stub server
+        self.host = auth_host if '://' in auth_host else 'https://' + auth_host
         self.email = email
         self.useragent = useragent if useragent else 'Freetrade/1.0.4756-4756 Dalvik/2.1.0 ' \
                                                      '(Linux; U; Android 9; SM-G965U Build/PPR1.180610.011)'
@@ -41,12 +58,21 @@ class Auth:
             ('User-Agent', self.useragent),
             ('Content-Type', 'application/x-www-form-urlencoded'),
             ('Content-Length', ''),
-            ('Host', self.credentials.get_ft_auth_host()),
-            ('Connection', 'close'),
+            ('Host', urlparse(self.host).netloc),
             ('Accept-Encoding', 'gzip, deflate')
         ])
 
-        self.authenticate()
+        if not lazy:
+            self.ensure_authenticated()
+
+    def ensure_authenticated(self):
+        if self.authenticated:
+            return
+
+        with self.authenticate_lock:
+            # another thread may have authenticated while waiting for the lock
+            if not self.authenticated:
+                self.authenticate()
 
     def get_request_header(self) -> OrderedDict:
         self.headers['request_id'] = str(uuid.uuid4())
@@ -54,13 +80,13 @@ class Auth:
 
     def login_request_otp(self) -> requests.Response:
         payload = {'email': self.email}
-        response = requests.post(self.host + '/start', data=payload, headers=self.get_request_header())
+        response = self.session.post(self.host + '/start', data=payload, headers=self.get_request_header())
 
         return response
 
     def login_with_otp(self, one_time_password: str) -> requests.Response:
         payload = {'email': self.email, 'otp': one_time_password}
-        response = requests.post(self.host + '/login', data=payload, headers=self.get_request_header())
+        response = self.session.post(self.host + '/login', data=payload, headers=self.get_request_header())
 
         content = response.json()
         self.custom_token = content['access_token']
@@ -68,6 +94,11 @@ class Auth:
         return response
 
     def authenticate(self, session_file: str = None):
+        if self.token_store is not None:
+            self.authenticate_with_store()
+            self.authenticated = True
+            return
+
         # default local user configs
         key_paths_list = [
             'ft-session.json',
@@ -97,14 +128,7 @@ class Auth:
 
         # if none of the files were successful, login again
         if session is None:
-            self.login_request_otp()
-            otp = self.otp_parser()
-            # get a Custom Token for authenticating Firebase client SDKs
-            # valid for 1 hour
-            self.login_with_otp(otp)
-
-            # get a refresh token (valid 1 year) and ID token (valid 1 hour)
-            self.get_firebase_tokens()
+            self.login()
 
             # save the new session
             with open(key_paths_list[0], 'w') as f:
@@ -114,45 +138,97 @@ class Auth:
                 }
                 json.dump(data, f)
 
+        self.authenticated = True
+
+    def authenticate_with_store(self):
+        session = self.token_store.get(self.email)
+        if session is not None:
+            # if there are issues with the stored session, just relogin again
+            try:
+                self.refresh_token = session['refresh_token']
+                self.headers['session_id'] = session['session_id']
+                # a stored ID token, which is still valid, saves the refresh request
+                if session['id_token'] is not None:
+                    self.set_id_token(session['id_token'])
+                self.tokens.refresh()
+                return
+            except Exception as e:
+                logger.error('Error reading stored session: {} - {}.'.format(type(e).__name__, str(e)))
+
+        self.login()
+
+    def login(self):
+        self.login_request_otp()
+        otp = self.otp_parser()
+        # get a Custom Token for authenticating Firebase client SDKs
+        # valid for 1 hour
+        self.login_with_otp(otp)
+
+        # get a refresh token (valid 1 year) and ID token (valid 1 hour)
+        self.get_firebase_tokens()
+
     def get_firebase_tokens(self):
         # if does not work, need new session token (relogin via authenticate)
         # exchange custom token -> a refresh and ID tokens
 
         # https://firebase.google.com/docs/reference/rest/auth
-        url = 'https://www.googleapis.com/identitytoolkit/v3/relyingparty/verifyCustomToken?key='\
-              + self.android_api_key
-        res = requests.post(url, json={
-            'token': self.custom_token,
-            'returnSecureToken': True
-        })
-
-        tokens = res.json()
-        self.refresh_token = tokens['refreshToken']
-        self.id_token = tokens['idToken']
+        url = self.credentials.get_google_identity_host() + \
+            '/identitytoolkit/v3/relyingparty/verifyCustomToken?key=' + self.android_api_key
+        with span(self.instrumentation, 'token_refresh', 'get_firebase_tokens'):
+            res = self.session.post(url, json={
+                'token': self.custom_token,
+                'returnSecureToken': True
+            })
+
+            tokens = res.json()
+            self.refresh_token = tokens['refreshToken']
+            self.set_id_token(tokens['idToken'])
+            self.save_tokens()
+
+    def get_refresh_id_token_request(self) -> tuple:
+        # url and form data of the refresh token exchange
+        url = self.credentials.get_google_token_host() + '/v1/token?key=' + self.android_api_key
+        data = {
+            'grant_type': 'refresh_token',
+            'refresh_token': self.refresh_token
+        }
+        return url, data
 
     def refresh_id_token(self):
         # exchange refresh token -> newer refresh and ID token
 
-        url = 'https://securetoken.googleapis.com/v1/token?key=' + self.android_api_key
-        res = requests.post(url, data={
-            'grant_type': 'refresh_token',
-            'refresh_token': self.refresh_token
-        })
+        with span(self.instrumentation, 'token_refresh', 'refresh_id_token'):
+            url, data = self.get_refresh_id_token_request()
+            res = self.session.post(url, data=data)
 
-        tokens = res.json()
+            self.set_refreshed_tokens(res.json())
+
+    def set_refreshed_tokens(self, tokens: dict):
         self.refresh_token = tokens['refresh_token']
-        self.id_token = tokens['id_token']
+        self.set_id_token(tokens['id_token'])
+        self.save_tokens()
+
+    def set_id_token(self, id_token: str):
+        self.id_token = id_token
+        self.tokens.set_token(id_token)
 
         self.headers['Authorization'] = self.get_auth_bearer()
         self.headers.move_to_end('Authorization', last=False)
 
+    def save_tokens(self):
+        # the refresh token changes with each refresh, so the token store is kept up to date
+        if self.token_store is not None:
+            self.token_store.put(self.email, self.headers['session_id'], self.refresh_token, self.id_token)
+
     def get_auth_bearer(self):
         return 'Bearer ' + self.id_token
 
-    def keep_id_token_valid(self):
-        decoded = jwt.decode(self.id_token, verify=False)
-        delta_time_valid = datetime.utcfromtimestamp(decoded['exp']) - datetime.utcnow()
+    def get_valid_auth_bearer(self) -> str:
+        # refreshes the ID token, only if it is about to expire
+        self.ensure_authenticated()
+        return self.tokens.get_bearer()
 
+    def keep_id_token_valid(self):
         # if less than 60 seconds left, refresh ID token
-        if delta_time_valid.total_seconds() < 60:
-            self.refresh_id_token()
+        self.ensure_authenticated()
+        self.tokens.get_bearer()
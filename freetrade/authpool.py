@@ -0,0 +1,131 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import requests
+
+from .api import API
+from .auth import Auth
+from .credentials import Credentials
+from .instrumentation import Instrumentation
+from .ratelimit import RateLimiter
+from .session import create_session
+from .tokenstore import TokenStore
+
+logger = logging.getLogger(__name__)
+
+
+class AuthPool:
+    # the Auth of many accounts, which share one token store, session and refresh thread
+    def __init__(self, credentials: Credentials, token_store: TokenStore = None, session: requests.Session = None,
+                 otp_parser: Callable[[str], str] = None, max_workers: int = 16, refresh_ahead: float = 300,
+                 background_refresh: bool = True, instrumentation: Instrumentation = None):
+        # token_store: by default ft-sessions.db in the working directory
+        # otp_parser: email -> OTP of a new login, by default read from the standard input
+        # max_workers: number of the parallel logins and refreshes
+        # refresh_ahead: seconds before the expiry, when the background thread refreshes an ID token
+        self.credentials = credentials
+        self.token_store = token_store if token_store is not None else TokenStore()
+        # the default rate limit of the Google token endpoint would serialise the refreshes of many accounts
+        self.session = session if session is not None else create_session(
+            pool_maxsize=max_workers, rate_limiter=RateLimiter({'google': max_workers}),
+            instrumentation=instrumentation)
+        self.otp_parser = otp_parser
+        self.max_workers = max_workers
+        self.refresh_ahead = refresh_ahead
+        self.instrumentation = instrumentation
+
+        self.auths = {}
+        self.lock = threading.Lock()
+        self.otp_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        if background_refresh:
+            self.start()
+
+    def add(self, email: str, otp_parser: Callable[[], str] = None) -> Auth:
+        # the account logs in on first use, or with authenticate_all
+        with self.lock:
+            if email not in self.auths:
+                if otp_parser is None and self.otp_parser is not None:
+                    otp_parser = lambda: self.otp_parser(email)
+                # the pool refreshes the tokens of all accounts in one thread, instead of a timer per account
+                auth = Auth(self.credentials, email, otp_parser=otp_parser, session=self.session,
+                            background_refresh=False, instrumentation=self.instrumentation,
+                            lazy=True, token_store=self.token_store)
+                # the new logins ask for their OTP one at a time, the stored sessions still refresh in parallel
+                auth.otp_parser = lambda parse_otp=auth.otp_parser: self.parse_otp(parse_otp)
+                self.auths[email] = auth
+            return self.auths[email]
+
+    def parse_otp(self, otp_parser: Callable[[], str]) -> str:
+        with self.otp_lock:
+            return otp_parser()
+
+    def get(self, email: str) -> Auth:
+        return self.auths[email] if email in self.auths else self.add(email)
+
+    def get_emails(self) -> list:
+        with self.lock:
+            return list(self.auths)
+
+    def get_bearer(self, email: str) -> str:
+        # a valid bearer, authenticating or refreshing first, if needed
+        return self.get(email).get_valid_auth_bearer()
+
+    def get_api(self, email: str) -> API:
+        return API(self.get(email), self.credentials.get_ft_api_host(), session=self.session,
+                   instrumentation=self.instrumentation)
+
+    def map(self, function: Callable[[Auth], None], emails: list) -> dict:
+        # runs function for each account in parallel, returns email -> exception of the failed ones
+        def run(email: str) -> Exception or None:
+            try:
+                function(self.get(email))
+            except Exception as e:
+                logger.error('Error authenticating {}: {} - {}.'.format(email, type(e).__name__, str(e)))
+                return e
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            errors = dict(zip(emails, executor.map(run, emails)))
+        return {email: error for email, error in errors.items() if error is not None}
+
+    def authenticate_all(self, emails: list = None) -> dict:
+        # brings up the accounts (all added by default) in parallel, returns email -> exception of the failed ones
+        # the stored sessions need one refresh request, or none, while their ID tokens are valid
+        emails = self.get_emails() if emails is None else emails
+        return self.map(lambda auth: auth.ensure_authenticated(), emails)
+
+    def refresh_all(self, force: bool = False) -> dict:
+        # refreshes the ID tokens, which expire within refresh_ahead seconds, in parallel
+        # returns email -> exception of the failed ones
+        emails = [email for email, auth in list(self.auths.items())
+                  if auth.authenticated and (force or auth.tokens.expires_within(self.refresh_ahead))]
+        return self.map(lambda auth: auth.tokens.refresh(force=True), emails)
+
+    def get_bearers(self, emails: list = None) -> tuple:
+        # (email -> valid bearer, email -> exception), after bringing up the accounts in parallel
+        # the failed accounts are not retried, and have no bearer
+        emails = self.get_emails() if emails is None else emails
+        errors = self.authenticate_all(emails)
+        return {email: self.get_bearer(email) for email in emails if email not in errors}, errors
+
+    def run_refresh(self, interval: float):
+        while not self.stop_event.wait(interval):
+            self.refresh_all()
+
+    def start(self, interval: float = 30.0):
+        # background thread, which refreshes the expiring ID tokens every interval seconds
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run_refresh, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
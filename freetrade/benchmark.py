@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+from . import Credentials, Auth, API, Index, DataStore, FreeTrade, BinaryStorage, ShardedStorage, create_session
+from .fakeserver import FakeFreeTrade
+
+
+def measure(name: str, tickers: int, function: Callable, repeat: int = 3, setup: Callable = None) -> dict:
+    # setup runs before each repetition, and is not measured
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'name': name,
+        'tickers': tickers,
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings)
+    }
+
+
+def measure_import(statement: str, repeat: int = 3) -> dict:
+    # runs the statement in a fresh interpreter, less the interpreter's own startup,
+    # and reports which of the heavy dependencies it imported
+    code = ('import sys, time; start = time.perf_counter(); ' + statement +
+            '; print(time.perf_counter() - start); print(",".join(sorted(m for m in '
+            '("requests", "numpy", "pandas", "jwt", "dateutil") if m in sys.modules)))')
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout.split('\n')
+        timings.append(float(output[0]))
+
+    return {
+        'name': f'import[{statement}]',
+        'tickers': 0,
+        'repeat': repeat,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+        'modules': [module for module in output[1].split(',') if module]
+    }
+
+
+def run_startup_benchmarks(repeat: int = 3) -> list:
+    results = [measure_import(statement, repeat)
+               for statement in ('import freetrade', 'from freetrade import FreeTrade')]
+
+    with FakeFreeTrade(tickers=1) as fake:
+        directory = tempfile.mkdtemp(prefix='freetrade-benchmark-')
+        cwd = os.getcwd()
+        try:
+            os.chdir(directory)
+            fake.write_keys('ft-keys.json')
+            # with the default lazy auth, no requests are made
+            results.append(measure('FreeTrade.__init__', 0,
+                                   lambda: FreeTrade('benchmark@example.com', 'ft-keys.json'), repeat))
+            results.append(measure('FreeTrade.__init__[lazy_auth=False]', 0,
+                                   lambda: FreeTrade('benchmark@example.com', 'ft-keys.json',
+                                                     otp_parser=lambda: '000000', lazy_auth=False), repeat))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+def run_benchmarks(tickers: int, latency: float = 0.0, repeat: int = 3, history_sample: int = 100,
+                   workers: int = 8) -> list:
+    results = []
+    directory = tempfile.mkdtemp(prefix='freetrade-benchmark-')
+    cwd = os.getcwd()
+
+    with FakeFreeTrade(tickers=tickers, latency=latency) as fake:
+        try:
+            # Auth saves its session file into the working directory
+            os.chdir(directory)
+            fake.write_keys('ft-keys.json')
+            credentials = Credentials('ft-keys.json')
+            session = create_session(pool_maxsize=workers, rate_limiter=False)
+
+            index = Index(credentials, session=session)
+            results.append(measure('Index.get_assets', tickers, index.get_assets, repeat,
+                                   setup=lambda: index.__init__(credentials, session=session)))
+
+            auth = Auth(credentials, 'benchmark@example.com', otp_parser=lambda: '000000', session=session,
+                        background_refresh=False)
+            api = API(auth, credentials.get_ft_api_host(), session=session)
+            sample = [(asset.symbol, asset.exchange) for asset in index.get_catalogue()][:history_sample]
+
+            def get_ticker_histories():
+                for ticker, ftexchange in sample:
+                    api.get_ticker_history(ticker, ftexchange, '1y')
+
+            result = measure('API.get_ticker_history', tickers, get_ticker_histories, repeat)
+            result['calls'] = len(sample)
+            results.append(result)
+
+            history = os.path.join(directory, 'history')
+            for storage in (ShardedStorage(), BinaryStorage(), None):
+                datastore = DataStore(api, index, storage)
+                name = type(datastore.storage).__name__
+
+                results.append(measure(f'DataStore.update_historical_prices[{name}, full]', tickers,
+                                       lambda: datastore.update_historical_prices(history, workers=workers), repeat,
+                                       setup=lambda: shutil.rmtree(history, ignore_errors=True)))
+                results.append(measure(f'DataStore.update_historical_prices[{name}, incremental]', tickers,
+                                       lambda: datastore.update_historical_prices(history, workers=workers), repeat))
+                results.append(measure(f'DataStore.load_historical_data_as_dataframe[{name}]', tickers,
+                                       lambda: datastore.load_historical_data_as_dataframe(history), repeat))
+                shutil.rmtree(history, ignore_errors=True)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Benchmarks of freetrade against a local fake server.')
+    parser.add_argument('--tickers', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='numbers of the generated tickers')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions of each benchmark')
+    parser.add_argument('--history-sample', type=int, default=100,
+                        help='number of the tickers for API.get_ticker_history')
+    parser.add_argument('--workers', type=int, default=8, help='workers of DataStore.update_historical_prices')
+    parser.add_argument('--output', help='JSON file for the results, standard output by default')
+    options = parser.parse_args(args)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'latency': options.latency,
+            'repeat': options.repeat,
+            'workers': options.workers
+        },
+        'results': run_startup_benchmarks(options.repeat)
+    }
+    for tickers in options.tickers:
+        report['results'] += run_benchmarks(tickers, options.latency, options.repeat, options.history_sample,
+                                            options.workers)
+
+    if options.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Callable
+
+import numpy as np
+
+from .calendars import get_calendar
+from .storage import BinaryStorage, HISTORY_DTYPE
+
+
+class HistoryCache:
+    def __init__(self, max_entries: int = 1024, directory: str = None):
+        # max_entries: number of (ticker, exchange) histories kept in memory
+        # directory: if given, the histories are also persisted there
+        self.max_entries = max_entries
+        self.directory = directory
+        self.storage = BinaryStorage()
+
+        # (ticker, exchange) -> (first covered date, prices of the closed trading days)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # hits: served from the cache without a request, partial_hits: only the newer days were fetched
+        self.stats = {
+            'hits': 0,
+            'partial_hits': 0,
+            'misses': 0
+        }
+
+    @staticmethod
+    def get_name(ticker: str, ftexchange: str) -> str:
+        return ftexchange + '_' + ticker
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def load_entry(self, ticker: str, ftexchange: str) -> tuple or None:
+        key = (ticker, ftexchange)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        if self.directory is None:
+            return None
+
+        name = self.get_name(ticker, ftexchange)
+        start_file = self.directory + os.sep + name + '.start'
+        if not os.path.isfile(start_file) or not self.storage.exists(name, self.directory):
+            return None
+
+        with open(start_file, 'r') as f:
+            start = np.datetime64(f.read().strip(), 'D')
+        entry = (start, self.storage.load(name, self.directory))
+        self.store_entry(ticker, ftexchange, entry, persist=False)
+        return entry
+
+    def store_entry(self, ticker: str, ftexchange: str, entry: tuple, persist: bool = True):
+        with self.lock:
+            self.entries[(ticker, ftexchange)] = entry
+            self.entries.move_to_end((ticker, ftexchange))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if persist and self.directory is not None:
+            name = self.get_name(ticker, ftexchange)
+            start, prices = entry
+            self.storage.write(prices, name, self.directory)
+            with open(self.directory + os.sep + name + '.start', 'w') as f:
+                f.write(str(start))
+
+    def get_ticker_history(self, ticker: str, ftexchange: str, start_date: date,
+                           fetch: Callable[[date], np.ndarray]) -> np.ndarray:
+        # fetch: downloads the prices since the given date, as an array of HISTORY_DTYPE
+        # the prices of the closed trading days never change, thus only the days after the last cached one are fetched,
+        # and nothing, if the last cached day is the last closed session of the exchange
+        start = np.datetime64(start_date, 'D')
+        today = np.datetime64(date.today(), 'D')
+
+        entry = self.load_entry(ticker, ftexchange)
+        if entry is None or entry[0] > start or len(entry[1]) == 0:
+            with self.lock:
+                self.stats['misses'] += 1
+            cached = np.empty(0, dtype=HISTORY_DTYPE)
+            fetched = fetch(start_date)
+        elif entry[1]['date'][-1] >= np.datetime64(get_calendar(ftexchange).get_last_closed_session(), 'D'):
+            with self.lock:
+                self.stats['hits'] += 1
+            cached = entry[1]
+            fetched = np.empty(0, dtype=HISTORY_DTYPE)
+            start = entry[0]
+        else:
+            with self.lock:
+                self.stats['partial_hits'] += 1
+            cached = entry[1]
+            fetched = fetch((cached['date'][-1] + np.timedelta64(1, 'D')).astype(date))
+            fetched = fetched[fetched['date'] > cached['date'][-1]]
+            start = entry[0]
+
+        prices = np.concatenate((cached, fetched))
+        # today's price can still change
+        closed = prices[prices['date'] < today]
+        if len(closed) > len(cached):
+            self.store_entry(ticker, ftexchange, (start, closed))
+
+        return prices[prices['date'] >= np.datetime64(start_date, 'D')]
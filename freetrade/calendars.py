@@ -0,0 +1,172 @@
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Callable
+
+import numpy as np
+from dateutil import tz
+from dateutil.easter import easter
+from dateutil.relativedelta import relativedelta, MO, TH
+
+
+def substitute_weekends(days: list) -> list:
+    # UK rule: a holiday on a weekend, or on another holiday, moves to the next free weekday
+    substitutes = []
+    for day in days:
+        while day.weekday() >= 5 or day in substitutes:
+            day += timedelta(days=1)
+        substitutes.append(day)
+    return substitutes
+
+
+def observe_nearest_weekday(day: date) -> date:
+    # US rule: a holiday on a Saturday is observed on the Friday before, on a Sunday the Monday after
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+
+# XLON closures, which differ from the rules: year -> (moved away holidays, extra holidays)
+XLON_SPECIAL_HOLIDAYS = {
+    2002: ([date(2002, 5, 27)], [date(2002, 6, 3), date(2002, 6, 4)]),
+    2011: ([], [date(2011, 4, 29)]),
+    2012: ([date(2012, 5, 28)], [date(2012, 6, 4), date(2012, 6, 5)]),
+    2020: ([date(2020, 5, 4)], [date(2020, 5, 8)]),
+    2022: ([date(2022, 5, 30)], [date(2022, 6, 2), date(2022, 6, 3), date(2022, 9, 19)]),
+    2023: ([], [date(2023, 5, 8)]),
+}
+
+# unscheduled NYSE and Nasdaq closures
+US_SPECIAL_HOLIDAYS = [
+    date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14),
+    date(2004, 6, 11), date(2007, 1, 2), date(2012, 10, 29), date(2012, 10, 30),
+    date(2018, 12, 5), date(2025, 1, 9),
+]
+
+
+def get_xlon_holidays(year: int) -> list:
+    # England and Wales bank holidays
+    easter_sunday = easter(year)
+    holidays = substitute_weekends([date(year, 1, 1)]) + [
+        easter_sunday - timedelta(days=2),  # Good Friday
+        easter_sunday + timedelta(days=1),  # Easter Monday
+        date(year, 5, 1) + relativedelta(weekday=MO(+1)),  # Early May
+        date(year, 5, 31) + relativedelta(weekday=MO(-1)),  # Spring
+        date(year, 8, 31) + relativedelta(weekday=MO(-1)),  # Summer
+    ] + substitute_weekends([date(year, 12, 25), date(year, 12, 26)])
+
+    moved, extra = XLON_SPECIAL_HOLIDAYS.get(year, ([], []))
+    return sorted(set(holidays) - set(moved) | set(extra))
+
+
+def get_us_holidays(year: int) -> list:
+    # NYSE and Nasdaq holidays
+    holidays = [
+        date(year, 1, 15) + relativedelta(weekday=MO(+1)),  # Martin Luther King Jr. Day, 3rd Monday
+        date(year, 2, 15) + relativedelta(weekday=MO(+1)),  # Washington's Birthday, 3rd Monday
+        easter(year) - timedelta(days=2),  # Good Friday
+        date(year, 5, 31) + relativedelta(weekday=MO(-1)),  # Memorial Day
+        observe_nearest_weekday(date(year, 7, 4)),  # Independence Day
+        date(year, 9, 1) + relativedelta(weekday=MO(+1)),  # Labor Day
+        date(year, 11, 1) + relativedelta(weekday=TH(+4)),  # Thanksgiving
+        observe_nearest_weekday(date(year, 12, 25)),  # Christmas
+    ]
+    # New Year's Day on a Saturday is not observed on the last trading day of the year before
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.append(observe_nearest_weekday(new_year))
+    if year >= 2022:
+        holidays.append(observe_nearest_weekday(date(year, 6, 19)))  # Juneteenth
+
+    return sorted(set(holidays) | {day for day in US_SPECIAL_HOLIDAYS if day.year == year})
+
+
+class ExchangeCalendar:
+    def __init__(self, exchange: str, timezone: str, close: time, get_holidays: Callable[[int], list] = None,
+                 publish_delay: timedelta = timedelta(minutes=15)):
+        # close: the local closing time of a regular session, early closes are not modelled
+        # get_holidays: year -> list of the weekdays without a session
+        # publish_delay: time after the close, until the prices of a session are expected upstream
+        self.exchange = exchange
+        self.timezone = tz.gettz(timezone)
+        self.close = close
+        self.get_holidays = get_holidays if get_holidays is not None else lambda year: []
+        self.publish_delay = publish_delay
+
+        # weekday calendar with the holidays of the years first_year..last_year
+        self.lock = threading.Lock()
+        self.first_year = None
+        self.last_year = None
+        self.busdaycalendar = None
+
+    def get_busdaycalendar(self, *days: date or np.datetime64) -> np.busdaycalendar:
+        # the calendar, covering the years of the days
+        years = [int(str(np.datetime64(day, 'Y'))) for day in days]
+        with self.lock:
+            if self.busdaycalendar is None or min(years) < self.first_year or max(years) > self.last_year:
+                # a year of margin, as the previous or the next session may be in the neighbouring year
+                self.first_year = min(years + [self.first_year or min(years)]) - 1
+                self.last_year = max(years + [self.last_year or max(years)]) + 1
+                holidays = [day for year in range(self.first_year, self.last_year + 1)
+                            for day in self.get_holidays(year)]
+                self.busdaycalendar = np.busdaycalendar(holidays=holidays)
+            return self.busdaycalendar
+
+    def is_session(self, day: date or np.datetime64) -> bool:
+        return bool(np.is_busday(np.datetime64(day, 'D'), busdaycal=self.get_busdaycalendar(day)))
+
+    def get_previous_session(self, day: date or np.datetime64) -> date:
+        # the last session on or before the day
+        return np.busday_offset(np.datetime64(day, 'D'), 0, roll='backward',
+                                busdaycal=self.get_busdaycalendar(day)).astype(date)
+
+    def get_next_session(self, day: date or np.datetime64) -> date:
+        # the first session after the day
+        return np.busday_offset(np.datetime64(day, 'D'), 1, roll='backward',
+                                busdaycal=self.get_busdaycalendar(day)).astype(date)
+
+    def count_sessions(self, start: date or np.datetime64, end: date or np.datetime64) -> int:
+        # number of the sessions after start, up to and including end
+        start = np.datetime64(start, 'D') + np.timedelta64(1, 'D')
+        end = np.datetime64(end, 'D') + np.timedelta64(1, 'D')
+        return max(int(np.busday_count(start, end, busdaycal=self.get_busdaycalendar(start, end))), 0)
+
+    def get_available_time(self, day: date) -> datetime:
+        # when the prices of the session on the day are expected upstream
+        return datetime.combine(day, self.close, tzinfo=self.timezone) + self.publish_delay
+
+    def now(self, now: datetime = None) -> datetime:
+        # now, in the timezone of the exchange
+        return (now if now is not None else datetime.now(tz.UTC)).astimezone(self.timezone)
+
+    def get_last_closed_session(self, now: datetime = None) -> date:
+        # the latest session, whose prices are expected upstream by now
+        now = self.now(now)
+        session = self.get_previous_session(now.date())
+        if now < self.get_available_time(session):
+            session = self.get_previous_session(session - timedelta(days=1))
+        return session
+
+    def get_next_available_time(self, now: datetime = None) -> datetime:
+        # when the prices of the next session are expected upstream
+        now = self.now(now)
+        session = self.get_previous_session(now.date())
+        while self.get_available_time(session) <= now:
+            session = self.get_next_session(session)
+        return self.get_available_time(session)
+
+
+# calendars of the exchanges of the assets (Catalogue exchange values)
+CALENDARS = {
+    'XLON': ExchangeCalendar('XLON', 'Europe/London', time(16, 30), get_xlon_holidays),
+    'XNYS': ExchangeCalendar('XNYS', 'America/New_York', time(16, 0), get_us_holidays),
+    'XNAS': ExchangeCalendar('XNAS', 'America/New_York', time(16, 0), get_us_holidays),
+}
+
+# exchanges without a calendar trade on every weekday, and close at midnight UTC
+DEFAULT_CALENDAR = ExchangeCalendar('DEFAULT', 'UTC', time(23, 59))
+
+
+def get_calendar(exchange: str) -> ExchangeCalendar:
+    return CALENDARS.get(exchange, DEFAULT_CALENDAR)
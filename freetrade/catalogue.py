@@ -0,0 +1,94 @@
+from collections import namedtuple
+
+# compact record of an asset, the Algolia hit has many more (mostly presentational) fields
+Asset = namedtuple('Asset', [
+    'symbol',
+    'isin',
+    'exchange',
+    'currency',
+    'asset_class',
+    'country_of_incorporation',
+    'isa_eligible',
+    'coming_soon',
+    'long_title',
+    'short_title',
+    'object_id'
+])
+
+
+class Catalogue:
+    # fields with a prebuilt hash index
+    FACETS = ('symbol', 'isin', 'exchange', 'currency', 'asset_class', 'country_of_incorporation',
+              'isa_eligible', 'coming_soon')
+
+    def __init__(self, assets: list = None):
+        self.assets = []
+        # facet -> value -> set of rows in self.assets
+        self.indexes = {facet: {} for facet in self.FACETS}
+
+        for asset in assets or []:
+            self.add(asset)
+
+    @staticmethod
+    def asset_from_hit(hit: dict) -> Asset:
+        return Asset(
+            symbol=hit['symbol'],
+            isin=hit.get('isin'),
+            exchange=hit['exchange'],
+            currency=hit['currency'],
+            asset_class=hit['asset_class'],
+            country_of_incorporation=hit['country_of_incorporation'],
+            isa_eligible=hit.get('isa_eligible'),
+            coming_soon=hit.get('coming_soon'),
+            long_title=hit.get('long_title'),
+            short_title=hit.get('short_title'),
+            object_id=hit.get('objectID')
+        )
+
+    @classmethod
+    def from_hits(cls, hits: list) -> 'Catalogue':
+        return cls(map(cls.asset_from_hit, hits))
+
+    def add(self, asset: Asset):
+        row = len(self.assets)
+        self.assets.append(asset)
+
+        for facet in self.FACETS:
+            self.indexes[facet].setdefault(getattr(asset, facet), set()).add(row)
+
+    def __len__(self) -> int:
+        return len(self.assets)
+
+    def __iter__(self):
+        return iter(self.assets)
+
+    def get_by_symbol(self, symbol: str) -> Asset or None:
+        rows = self.indexes['symbol'].get(symbol)
+        return self.assets[max(rows)] if rows else None
+
+    def get_by_isin(self, isin: str) -> Asset or None:
+        rows = self.indexes['isin'].get(isin)
+        return self.assets[max(rows)] if rows else None
+
+    def get_values(self, facet: str) -> list:
+        return list(self.indexes[facet].keys())
+
+    def filter(self, **facets) -> list:
+        # e.g. catalogue.filter(isa_eligible=True, currency='GBP', asset_class='ETF')
+        # a facet can be given a list or set of values, e.g. exchange=['XNYS', 'XNAS']
+        row_sets = []
+        for facet, value in facets.items():
+            index = self.indexes[facet]
+            if isinstance(value, (list, tuple, set, frozenset)):
+                row_sets.append(set().union(*(index.get(v, set()) for v in value)))
+            else:
+                row_sets.append(index.get(value, set()))
+
+        if not row_sets:
+            return list(self.assets)
+
+        # intersect starting from the smallest set
+        row_sets.sort(key=len)
+        rows = row_sets[0].intersection(*row_sets[1:])
+
+        return [self.assets[row] for row in sorted(rows)]
@@ -30,11 +30,25 @@ class Credentials:
     def get_android_verification_api_key(self) -> str:
         return self.API_KEYS['google_android_device_verification_api_key']
 
+    def get_google_identity_host(self) -> str:
+        # optional key, e.g. for a local stand-in
+        return self.API_KEYS.get('google_identity_host', 'https://www.googleapis.com')
+
+    def get_google_token_host(self) -> str:
+        # optional key, e.g. for a local stand-in
+        return self.API_KEYS.get('google_token_host', 'https://securetoken.googleapis.com')
+
     def get_algolia_api_key(self) -> str:
         return self.API_KEYS['algolia_api_key']
 
     def get_algolia_application_id(self) -> str:
         return self.API_KEYS['algolia_application_id']
 
+    def get_algolia_host(self) -> str:
+        # optional key, e.g. for a local Algolia stand-in
+        if 'algolia_host' in self.API_KEYS:
+            return self.API_KEYS['algolia_host']
+        return 'https://{}-dsn.algolia.net'.format(self.get_algolia_application_id().lower())
+
     def get_algolia_index_name(self) -> str:
         return self.API_KEYS['algolia_index_name']
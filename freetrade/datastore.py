@@ -1,92 +1,290 @@
-import csv
-import glob
-import os
+import logging
+import threading
+import time
 from collections import OrderedDict
-from datetime import datetime
-from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import date
+from typing import Callable, ContextManager, Iterator, TYPE_CHECKING
 
-import pandas as pd
-from dateutil.relativedelta import relativedelta
+import numpy as np
+import requests
 
-from freetrade import API, Index
+from .api import API, IEX_BATCH_SIZE, get_covering_duration
+from .derived import DerivedStore
+from .index import Index
+from .instrumentation import Instrumentation, span
+from .snapshot import Changes
+from .storage import Storage, CsvStorage, HISTORY_DTYPE, array_to_prices, columns_to_array
+
+# pandas is imported only by the DataFrame loader
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
 
 
 class DataStore:
-    def __init__(self, api: API, index: Index):
+    def __init__(self, api: API, index: Index, storage: Storage = None, instrumentation: Instrumentation = None,
+                 derived: DerivedStore = None):
         self.api = api
         self.index = index
+        # storage backend of the price history, CSV files by default
+        self.storage = storage if storage is not None else CsvStorage()
+        # receives the timings of the load and write phases
+        self.instrumentation = instrumentation
+        # optional returns, rolling statistics and drawdown, updated with the prices
+        self.derived = derived
+
+    def load_historical_price(self, ticker: str, directory: str = 'history') -> OrderedDict:
+        # date -> price of the stored history
+        return array_to_prices(self.storage.load(ticker, directory))
+
+    def write_historical_price(self, prices: OrderedDict, ticker: str, directory: str = 'history',
+                               exchange: str = None):
+        # replaces the stored history with date -> price
+        # exchange: required by ShardedStorage for the new tickers
+        self.storage.write(columns_to_array(list(prices.keys()), list(prices.values())), ticker, directory, exchange)
+        self.storage.flush(directory)
+
+    def load_historical_data_as_dataframe(self, directory: str = 'history', tickers: list = None,
+                                          start: str or date = None, end: str or date = None,
+                                          dtype: str = 'float64', workers: int = 8) -> 'pd.DataFrame':
+        # tickers: subset of columns to load, all stored tickers by default
+        # start, end: inclusive date range, e.g. '2019-01-01'
+        # dtype: dtype of the prices, e.g. 'float32' halves the memory
+        # workers: threads reading the files, or processes reading the shards of ShardedStorage
+        import pandas as pd
+
+        columns = self.storage.get_tickers(directory) if tickers is None else list(tickers)
+        if len(columns) == 0:
+            return pd.DataFrame()
+
+        histories = self.load_histories(directory, tickers, start, end, workers)
+        with span(self.instrumentation, 'datastore', 'datastore.align', tickers=len(histories)):
+            return self.to_dataframe(histories, dtype)
+
+    def load_histories(self, directory: str = 'history', tickers: list = None, start: str or date = None,
+                       end: str or date = None, workers: int = 8) -> OrderedDict:
+        # ticker -> history within the inclusive date range, empty for a ticker without a stored history
+        columns = self.storage.get_tickers(directory) if tickers is None else list(tickers)
+        with span(self.instrumentation, 'datastore', 'datastore.load', tickers=len(columns)) as extra:
+            parts = OrderedDict((ticker, []) for ticker in columns)
+            for chunk in self.storage.scan(directory, tickers, start, end, workers):
+                for ticker, history in chunk.items():
+                    parts[ticker].append(history)
+            histories = OrderedDict((ticker, np.concatenate(part) if part else np.empty(0, dtype=HISTORY_DTYPE))
+                                    for ticker, part in parts.items())
+            extra['rows'] = sum(len(history) for history in histories.values())
+            extra['bytes_in'] = sum(history.nbytes for history in histories.values())
+
+        return histories
+
+    def iter_historical_data_as_dataframes(self, directory: str = 'history', tickers: list = None,
+                                           start: str or date = None, end: str or date = None,
+                                           dtype: str = 'float64', workers: int = 8) -> Iterator['pd.DataFrame']:
+        # lazily yields a DataFrame for each chunk of the storage, i.e. a group of the tickers,
+        # or an exchange and year of ShardedStorage, so that the whole history is never in memory
+        for chunk in self.storage.scan(directory, tickers, start, end, workers):
+            if chunk:
+                yield self.to_dataframe(chunk, dtype)
+
+    def load_derived_as_dataframe(self, field: str, directory: str = 'history', tickers: list = None,
+                                  start: str or date = None, end: str or date = None,
+                                  dtype: str = 'float64') -> 'pd.DataFrame':
+        # field: a derived series, e.g. 'log_return', 'std_20' or 'drawdown', see DerivedStore
+        import pandas as pd
+
+        if self.derived is None:
+            raise ValueError('A DerivedStore is required, see the derived argument of DataStore')
+
+        tickers = self.storage.get_tickers(directory) if tickers is None else list(tickers)
+        tickers = [ticker for ticker in tickers if self.derived.exists(ticker, directory)]
+        if len(tickers) == 0:
+            return pd.DataFrame()
+
+        with span(self.instrumentation, 'datastore', 'datastore.load', tickers=len(tickers), field=field):
+            histories = OrderedDict((ticker, self.derived.load(ticker, directory, start, end)) for ticker in tickers)
+        with span(self.instrumentation, 'datastore', 'datastore.align', tickers=len(tickers), field=field):
+            return self.to_dataframe(histories, dtype, field)
 
     @staticmethod
-    def load_historical_price(ticker: str, directory: str = 'history') -> OrderedDict:
-        ticker_file = directory + os.sep + ticker + '.csv'
-        old_prices = OrderedDict()
-        with open(ticker_file, 'r') as f:
-            r = csv.reader(f)
-            for line in r:
-                history_date, history_price = line
-                history_price = float(history_price)
-                old_prices[history_date] = history_price
-        return old_prices
+    def align_histories(histories: OrderedDict, dtype: str = 'float64', field: str = 'close') -> tuple:
+        # aligns ticker -> history on the shared dates in a single pass,
+        # returns (dates, values), a column of values for each ticker
+        dates = np.unique(np.concatenate([history['date'] for history in histories.values()]
+                                         or [np.empty(0, dtype='M8[D]')]))
+        values = np.full((len(dates), len(histories)), np.nan, dtype=dtype)
+        for column, history in enumerate(histories.values()):
+            values[np.searchsorted(dates, history['date']), column] = history[field]
+        return dates, values
 
     @staticmethod
-    def write_historical_price(prices: OrderedDict, ticker: str, directory: str = 'history'):
-        ticker_file = directory + os.sep + ticker + '.csv'
+    def to_dataframe(histories: OrderedDict, dtype: str = 'float64', field: str = 'close') -> 'pd.DataFrame':
+        import pandas as pd
 
-        if not os.path.exists(directory):
-            os.makedirs(directory)
+        dates, values = DataStore.align_histories(histories, dtype, field)
+        return pd.DataFrame(values, index=pd.DatetimeIndex(dates, name='Date'), columns=list(histories))
 
-        with open(ticker_file, 'w') as f:
-            w = csv.writer(f)
-            w.writerows(prices.items())
+    def get_last_date(self, ticker: str, directory: str = 'history') -> np.datetime64 or None:
+        if not self.storage.exists(ticker, directory):
+            return None
+        return self.storage.get_last_date(ticker, directory)
 
     @staticmethod
-    def load_historical_data_as_dataframe(directory: str = 'history') -> pd.DataFrame:
-        files = glob.glob(f'{directory}/*.csv')
-        if len(files) == 0:
-            return pd.DataFrame()
+    def get_update_start_date(last_date: np.datetime64) -> date:
+        # the first date, which is not stored yet
+        return (last_date + np.timedelta64(1, 'D')).astype(date)
+
+    def save_new_prices(self, prices: np.ndarray, ticker: str, last_date: np.datetime64 or None,
+                        directory: str = 'history', exchange: str = None) -> int:
+        # returns the number of the new prices
+        # exchange: required by ShardedStorage for the new tickers
+        with span(self.instrumentation, 'datastore', 'datastore.write', ticker=ticker) as extra:
+            if last_date is None:
+                self.storage.write(prices, ticker, directory, exchange)
+            else:
+                # drop the overlapping and duplicate prices, and append the rest
+                prices = prices[prices['date'] > last_date]
+                _, unique_index = np.unique(prices['date'], return_index=True)
+                prices = prices[unique_index]
+                if len(prices):
+                    self.storage.append(prices, ticker, directory, exchange)
+
+            extra['rows'] = len(prices)
+            extra['bytes_out'] = prices.nbytes
+
+        if self.derived is not None:
+            # extends the derived series by the appended prices, or computes it from the whole history
+            with span(self.instrumentation, 'datastore', 'datastore.derive', ticker=ticker) as extra:
+                extra['rows'] = self.derived.update(self.storage, ticker, directory,
+                                                    None if last_date is None else len(prices))
+
+        return len(prices)
+
+    def update_historical_price(self, ticker: str, ftmarket: str, directory: str = 'history',
+                                request_limit: ContextManager = None) -> int:
+        # returns the number of the new prices
+        # request_limit: held during the request only, e.g. a semaphore bounding the concurrent requests
+        last_date = self.get_last_date(ticker, directory)
+
+        if last_date is None:
+            with request_limit or nullcontext():
+                prices = self.api.get_ticker_history(ticker, ftmarket, '5y', output='array')
+        else:
+            # fetch only the prices after the last stored date
+            start_date = self.get_update_start_date(last_date)
+            if start_date > date.today():
+                return 0
+            with request_limit or nullcontext():
+                prices = self.api.get_ticker_history(ticker, ftmarket, start_date=start_date, output='array')
+
+        return self.save_new_prices(prices, ticker, last_date, directory, ftmarket)
+
+    def update_historical_price_batch(self, tickers: list, duration: str, directory: str = 'history',
+                                      exchanges: dict = None, request_limit: ContextManager = None) -> dict:
+        # updates non XLON tickers with IEX trading batch requests, returns ticker -> number of the new prices
+        # the tickers missing from the response are left out, and nothing is written for them
+        # exchanges: ticker -> exchange, required by ShardedStorage for the new tickers
+        # request_limit: see update_historical_price
+        exchanges = {} if exchanges is None else exchanges
+        last_dates = {ticker: self.get_last_date(ticker, directory) for ticker in tickers}
+        with request_limit or nullcontext():
+            histories = self.api.get_ticker_histories_iextrading(tickers, duration, output='array')
+
+        return {ticker: self.save_new_prices(history, ticker, last_dates[ticker], directory, exchanges.get(ticker))
+                for ticker, history in histories.items()}
+
+    def update_changes(self, changes: Changes, directory: str = 'history', **kwargs) -> dict:
+        # backfills only the tickers added to the index, see Index.get_changes
+        # the removed tickers are no longer in the catalogue, so they are not updated, their history is kept
+        # kwargs: see update_historical_prices
+        return self.update_historical_prices(directory, tickers=[asset.symbol for asset in changes.get_added_assets()],
+                                             **kwargs)
+
+    def get_batch_jobs(self, tickers: list, directory: str = 'history', batch_size: int = IEX_BATCH_SIZE) -> list:
+        # groups the tickers by the IEX trading range covering their missing prices
+        groups = OrderedDict()
+        for ticker in tickers:
+            last_date = self.get_last_date(ticker, directory)
+            if last_date is None:
+                duration = '5y'
+            else:
+                start_date = self.get_update_start_date(last_date)
+                if start_date > date.today():
+                    continue
+                duration = get_covering_duration(start_date)
+            groups.setdefault(duration, []).append(ticker)
+
+        return [(group[i:i + batch_size], duration)
+                for duration, group in groups.items()
+                for i in range(0, len(group), batch_size)]
+
+    def update_historical_prices(self, directory: str = 'history', workers: int = 1,
+                                 max_per_host: int = 8, batch_size: int = IEX_BATCH_SIZE, tickers: list = None) -> dict:
+        # workers: size of the thread pool, 1 keeps the sequential behaviour
+        # max_per_host: upper bound of the concurrent requests sent to the API host, which proxies all upstreams
+        # batch_size: number of non XLON tickers in one IEX trading request, 1 requests them one by one
+        # tickers: only these tickers of the catalogue are updated, all of them by default
+        catalogue = self.index.get_catalogue()
+        selected = None if tickers is None else set(tickers)
+        assets = [asset for asset in catalogue if selected is None or asset.symbol in selected]
+        report = {
+            'updated': {},
+            'errors': {},
+            'timings': {}
+        }
+
+        # held by the jobs during their requests only, not while writing the prices
+        request_limit = threading.BoundedSemaphore(max_per_host)
+
+        def update(job: Callable[[], dict], tickers: list):
+            # the timing of a batch is reported for each of its tickers
+            start = time.perf_counter()
+            try:
+                new_prices = job()
+            except Exception as e:
+                for ticker in tickers:
+                    logger.error('Error updating {}: {} - {}.'.format(ticker, type(e).__name__, str(e)))
+                    report['errors'][ticker] = e
+            else:
+                report['updated'].update(new_prices)
+                # a ticker missing from a batch response is an error, as its own request would have failed
+                for ticker in tickers:
+                    if ticker not in new_prices:
+                        e = requests.HTTPError(f'No history of {ticker} in the IEX trading batch response')
+                        logger.error('Error updating {}: {} - {}.'.format(ticker, type(e).__name__, str(e)))
+                        report['errors'][ticker] = e
+            finally:
+                elapsed = time.perf_counter() - start
+                for ticker in tickers:
+                    report['timings'][ticker] = elapsed
+
+        def single_job(ticker: str, ftmarket: str) -> tuple:
+            return lambda: {ticker: self.update_historical_price(ticker, ftmarket, directory, request_limit)}, [ticker]
+
+        iex_exchanges = {asset.symbol: asset.exchange for asset in assets if asset.exchange != 'XLON'}
+
+        def batch_job(tickers: list, duration: str) -> tuple:
+            return lambda: self.update_historical_price_batch(tickers, duration, directory, iex_exchanges,
+                                                              request_limit), tickers
+
+        if batch_size > 1:
+            jobs = [single_job(asset.symbol, asset.exchange) for asset in assets if asset.exchange == 'XLON']
+            iex_tickers = list(iex_exchanges)
+            jobs += [batch_job(tickers, duration)
+                     for tickers, duration in self.get_batch_jobs(iex_tickers, directory, batch_size)]
+        else:
+            jobs = [single_job(asset.symbol, asset.exchange) for asset in assets]
+
+        if workers <= 1:
+            for job in jobs:
+                update(*job)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # results and errors are collected in report by each job
+                list(executor.map(lambda job: update(*job), jobs))
 
-        dm = pd.read_csv(files[0], header=None)
-        for file in files[1:]:
-            df = pd.read_csv(file, header=None)
-            dm = dm.merge(df, how='outer', on=0)
-
-        dm.columns = ['Date'] + list(map(lambda x: x[8:-4], files))
-        dm.set_index('Date', inplace=True)
-        dm.sort_index(inplace=True)
-
-        return dm
-
-    def update_historical_prices(self, directory: str = 'history'):
-        assets = self.index.get_assets()
-
-        for ftmarket, tickerlist in assets['exchange'].items():
-            for asset in tickerlist:
-                ticker = asset['symbol']
-                ticker_file = directory + os.sep + ticker + '.csv'
-
-                # load the historical prices
-                if os.path.isfile(ticker_file):
-                    old_prices = self.load_historical_price(ticker, directory)
-                    last_date_str = next(reversed(old_prices))  # YYYY-MM-DD: str
-                    last_date = datetime.strptime(last_date_str, '%Y-%m-%d')
-                    relative_delta = relativedelta(datetime.now(), last_date)
-
-                    duration = '1m'
-                    if relative_delta.years >= 2:
-                        duration = '5y'
-                    elif relative_delta.years >= 1:
-                        duration = '2y'
-                    elif relative_delta.months >= 6:
-                        duration = '1y'
-                    elif relative_delta.months >= 3:
-                        duration = '6m'
-                    elif relative_delta.months >= 1:
-                        duration = '3m'
-
-                    fetched_prices = self.api.get_ticker_history(ticker, ftmarket, duration)
-                    prices = OrderedDict(chain(old_prices.items(), fetched_prices.items()))
-                else:
-                    prices = self.api.get_ticker_history(ticker, ftmarket, '5y')
-
-                # update the file
-                self.write_historical_price(prices, ticker, directory)
+        # e.g. saves the manifest of ShardedStorage
+        self.storage.flush(directory)
+        return report
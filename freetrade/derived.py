@@ -0,0 +1,136 @@
+import os
+from datetime import date
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from .storage import Storage, HISTORY_DTYPE, select_dates, to_date
+
+
+def get_derived_dtype(windows: tuple) -> np.dtype:
+    # one record per trading day:
+    # log_return: log of the close over the previous close
+    # mean_<window>: moving average of the close
+    # std_<window>: standard deviation of the log returns, i.e. the daily volatility
+    # peak: running maximum of the close, drawdown: close / peak - 1
+    fields = [('date', 'M8[D]'), ('log_return', 'f8')]
+    for window in windows:
+        fields += [(f'mean_{window}', 'f8'), (f'std_{window}', 'f8')]
+    return np.dtype(fields + [('peak', 'f8'), ('drawdown', 'f8')])
+
+
+def rolling_windows(values: np.ndarray, window: int) -> np.ndarray:
+    # (len(values) - window + 1, window) view of the sliding windows, without copying
+    stride = values.strides[0]
+    return as_strided(values, shape=(len(values) - window + 1, window), strides=(stride, stride), writeable=False)
+
+
+def rolling(values: np.ndarray, window: int, statistic: str = 'mean') -> np.ndarray:
+    # 'mean' or sample standard deviation 'std' of the windows ending at each value, nan until a window is full
+    # a missing value (nan) makes only the windows containing it nan
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        windows = rolling_windows(np.ascontiguousarray(values, dtype='f8'), window)
+        if statistic == 'mean':
+            result[window - 1:] = windows.mean(axis=1)
+        else:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[window - 1:] = windows.std(axis=1, ddof=1)
+    return result
+
+
+def compute_derived(prices: np.ndarray, windows: tuple, context: np.ndarray = None,
+                    peak: float = np.nan) -> np.ndarray:
+    # derived records of prices (HISTORY_DTYPE)
+    # context: the prices before them, at least max(windows) to continue the rolling windows
+    # peak: running maximum of the close before them
+    context = np.empty(0, dtype=HISTORY_DTYPE) if context is None else context
+    close = np.concatenate((context['close'], prices['close'])).astype('f8')
+    new = slice(len(context), len(close))
+
+    log_return = np.full(len(close), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_return[1:] = np.diff(np.log(close))
+
+    derived = np.empty(len(prices), dtype=get_derived_dtype(windows))
+    derived['date'] = prices['date']
+    derived['log_return'] = log_return[new]
+    for window in windows:
+        derived[f'mean_{window}'] = rolling(close, window, 'mean')[new]
+        derived[f'std_{window}'] = rolling(log_return, window, 'std')[new]
+
+    # nan prices do not reset the peak
+    derived['peak'] = np.fmax.accumulate(np.concatenate(([peak], close[new])))[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derived['drawdown'] = close[new] / derived['peak'] - 1
+    return derived
+
+
+class DerivedStore:
+    # history/derived/<WINDOWS>/<TICKER>.bin with packed records of get_derived_dtype(windows),
+    # kept next to the raw history of a Storage, and appended to when new prices are appended
+    extension = '.bin'
+
+    def __init__(self, windows: tuple = (20, 60, 250)):
+        # windows: number of the trading days of the rolling means and standard deviations
+        self.windows = tuple(sorted(set(windows)))
+        self.dtype = get_derived_dtype(self.windows)
+        # the raw prices needed before the new ones
+        self.context = max(self.windows) if self.windows else 1
+
+    def get_directory(self, directory: str = 'history') -> str:
+        # a different set of windows has a different record layout, so it is kept apart
+        return directory + os.sep + 'derived' + os.sep + '-'.join(str(window) for window in self.windows)
+
+    def get_path(self, ticker: str, directory: str = 'history') -> str:
+        return self.get_directory(directory) + os.sep + ticker + self.extension
+
+    def exists(self, ticker: str, directory: str = 'history') -> bool:
+        return os.path.isfile(self.get_path(ticker, directory))
+
+    def load(self, ticker: str, directory: str = 'history', start: str or date = None,
+             end: str or date = None) -> np.ndarray:
+        return select_dates(np.fromfile(self.get_path(ticker, directory), dtype=self.dtype), to_date(start),
+                            to_date(end))
+
+    def get_last(self, ticker: str, directory: str = 'history') -> np.ndarray or None:
+        # the last record only
+        if not self.exists(ticker, directory):
+            return None
+        with open(self.get_path(ticker, directory), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self.dtype.itemsize:
+                return None
+            f.seek(-self.dtype.itemsize, os.SEEK_END)
+            return np.frombuffer(f.read(self.dtype.itemsize), dtype=self.dtype)[0]
+
+    def rebuild(self, storage: Storage, ticker: str, directory: str = 'history') -> int:
+        # recomputes the whole derived series from the raw history, returns the number of records
+        derived = compute_derived(storage.load(ticker, directory), self.windows)
+        os.makedirs(self.get_directory(directory), exist_ok=True)
+        derived.tofile(self.get_path(ticker, directory))
+        return len(derived)
+
+    def update(self, storage: Storage, ticker: str, directory: str = 'history', new_rows: int = None) -> int:
+        # extends the derived series with the raw prices after its last date, returns the number of new records
+        # new_rows: number of the prices just appended to the raw history, None rebuilds the series
+        last = self.get_last(ticker, directory)
+        if new_rows is None or last is None:
+            return self.rebuild(storage, ticker, directory)
+        if new_rows == 0:
+            return 0
+
+        tail = storage.load_tail(ticker, directory, self.context + new_rows)
+        context = tail[tail['date'] <= last['date']]
+        prices = tail[tail['date'] > last['date']]
+        # rebuilt, if the raw history does not continue the derived series, or it got ahead by more than
+        # the new prices, e.g. after a failed update, so that the windows are not full
+        whole_history = len(tail) < self.context + new_rows
+        if len(context) == 0 or context['date'][-1] != last['date'] or \
+                (len(context) < self.context and not whole_history):
+            return self.rebuild(storage, ticker, directory)
+
+        derived = compute_derived(prices, self.windows, context, last['peak'])
+        with open(self.get_path(ticker, directory), 'ab') as f:
+            f.write(derived.tobytes())
+        return len(derived)
@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import jwt
+import numpy as np
+
+# exchanges of the generated assets, in turns
+EXCHANGES = ('XLON', 'XNYS', 'XNAS')
+
+
+class FakeFreeTrade:
+    # a local stand-in for the Freetrade auth and API hosts, Algolia and the Google token endpoints,
+    # which replays responses of the same shape as the real ones, for benchmarks and offline runs
+    def __init__(self, tickers: int = 100, latency: float = 0.0, years: int = 5, token_lifetime: float = 3600,
+                 host: str = '127.0.0.1', port: int = 0):
+        # tickers: number of the generated assets
+        # latency: seconds added to each response
+        # years: depth of the generated price history
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.assets = [self.make_asset(i) for i in range(tickers)]
+        self.symbols = {asset['symbol']: asset for asset in self.assets}
+
+        today = np.datetime64(date.today(), 'D')
+        days = np.arange(today - np.timedelta64(366 * years, 'D'), today + np.timedelta64(1, 'D'))
+        self.dates = days[np.is_busday(days)]
+
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @staticmethod
+    def make_asset(i: int) -> dict:
+        exchange = EXCHANGES[i % len(EXCHANGES)]
+        isin = ('GB' if exchange == 'XLON' else 'US') + f'{i:010d}'
+        return {
+            'asset_class': 'ETF' if i % 5 == 0 else 'EQUITY',
+            'symbol': f'T{i}',
+            'isin': isin,
+            'exchange': exchange,
+            'currency': 'GBP' if exchange == 'XLON' else 'USD',
+            'country_of_incorporation': 'GB' if exchange == 'XLON' else 'US',
+            'long_title': f'Test asset {i}',
+            'short_title': f'Test {i}',
+            'subtitle': 'Generated',
+            'logo_4x': '',
+            'isa_eligible': i % 3 != 2,
+            'coming_soon': False,
+            'required_version': '1.0',
+            'objectID': isin
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def get_keys(self) -> dict:
+        # the content of ft-keys.json pointing all the hosts to this server
+        return {
+            'algolia_api_key': 'fake',
+            'algolia_application_id': 'fake',
+            'algolia_index_name': 'assets',
+            'algolia_host': self.url,
+            'google_android_device_verification_api_key': 'fake',
+            'google_identity_host': self.url,
+            'google_token_host': self.url,
+            'prod_auth_dealstream_host': self.url,
+            'prod_dealstream_host': self.url
+        }
+
+    def write_keys(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.get_keys(), f)
+
+    def start(self) -> 'FakeFreeTrade':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'FakeFreeTrade':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def get_prices(self, symbol: str, start: np.datetime64 = None) -> tuple:
+        # deterministic random walk of a symbol, as (dates, closing prices)
+        seed = zlib.crc32(symbol.encode())
+        returns = np.random.RandomState(seed).normal(0.0002, 0.015, len(self.dates))
+        prices = np.round(100 * np.exp(np.cumsum(returns)), 4)
+        if start is None:
+            return self.dates, prices
+        mask = self.dates >= start
+        return self.dates[mask], prices[mask]
+
+    def get_range_start(self, duration: str) -> np.datetime64:
+        today = date.today()
+        starts = {
+            '1d': today,
+            '5d': today - timedelta(days=5),
+            '1m': today - timedelta(days=31),
+            '3m': today - timedelta(days=92),
+            '6m': today - timedelta(days=183),
+            'ytd': date(today.year, 1, 1),
+            '1y': today - timedelta(days=366),
+            '2y': today - timedelta(days=731),
+        }
+        return np.datetime64(starts.get(duration, today - timedelta(days=1827)), 'D')
+
+    def get_chart(self, symbol: str, duration: str) -> list:
+        dates, prices = self.get_prices(symbol, self.get_range_start(duration))
+        return [{'date': history_date, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': 1000}
+                for history_date, price in zip(dates.astype(str).tolist(), prices.tolist())]
+
+    def make_token(self) -> str:
+        token = jwt.encode({'exp': int(time.time() + self.token_lifetime), 'sub': 'fake'}, 'fake')
+        return token.decode() if isinstance(token, bytes) else token
+
+    def handle(self, method: str, path: str, query: dict, body: dict) -> tuple:
+        # returns (status, content)
+        if method == 'POST' and path == '/start':
+            return 200, {}
+        if method == 'POST' and path == '/login':
+            return 200, {'access_token': 'fake-custom-token'}
+        if method == 'POST' and path.endswith('/verifyCustomToken'):
+            return 200, {'refreshToken': 'fake-refresh-token', 'idToken': self.make_token()}
+        if method == 'POST' and path == '/v1/token':
+            return 200, {'refresh_token': 'fake-refresh-token', 'id_token': self.make_token()}
+
+        if path.startswith('/1/indexes/') and path.endswith('/browse'):
+            params = parse_qs(body.get('params', [''])[0])
+            hits_per_page = int(params.get('hitsPerPage', ['1000'])[0])
+            start = int(body.get('cursor', ['0'])[0])
+            content = {'hits': self.assets[start:start + hits_per_page]}
+            if start + hits_per_page < len(self.assets):
+                content['cursor'] = str(start + hits_per_page)
+            return 200, content
+
+        if path.startswith('/proxy/quandl/v3/datasets/'):
+            symbol = path.split('/')[-2].replace('_', '.')
+            if symbol not in self.symbols:
+                return 404, {}
+            start = np.datetime64(query.get('start_date', [str(date.today())])[0], 'D')
+            dates, prices = self.get_prices(symbol, start)
+            data = [list(row) for row in zip(dates.astype(str).tolist(), prices.tolist())]
+            return 200, {'dataset_data': {'column_names': ['Date', 'Price'], 'data': data}}
+
+        if path == '/proxy/iex/v1/stock/market/batch':
+            duration = query.get('range', ['1m'])[0]
+            symbols = query.get('symbols', [''])[0].split(',')
+            return 200, {symbol: {'chart': self.get_chart(symbol, duration)}
+                         for symbol in symbols if symbol in self.symbols}
+
+        if path.startswith('/proxy/iex/v1/stock/'):
+            parts = path.split('/')
+            symbol, duration = parts[-3], parts[-1]
+            if symbol not in self.symbols:
+                return 404, {}
+            return 200, self.get_chart(symbol, duration)
+
+        return 404, {}
+
+    def make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self, method: str):
+                with fake.lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                length = int(self.headers.get('Content-Length') or 0)
+                raw_body = self.rfile.read(length).decode() if length else ''
+                if self.headers.get('Content-Type', '').startswith('application/json') and raw_body.startswith('{'):
+                    body = {key: [value] for key, value in json.loads(raw_body).items()}
+                else:
+                    body = parse_qs(raw_body)
+
+                url = urlparse(self.path)
+                status, content = fake.handle(method, url.path, parse_qs(url.query), body)
+
+                data = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.respond('GET')
+
+            def do_POST(self):
+                self.respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,13 @@
+import os
+from typing import Callable
+
+
+def atomic_write(path: str, mode: str, writer: Callable):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # write to a temporary file first, so that readers never see a partial file
+    with open(path + '.tmp', mode) as f:
+        writer(f)
+    os.replace(path + '.tmp', path)
@@ -1,20 +1,40 @@
 from typing import Callable
 
-from . import Credentials, Auth, API, Index, DataStore
+import requests
+
+from .api import API
+from .auth import Auth
+from .cache import HistoryCache
+from .credentials import Credentials
+from .datastore import DataStore
+from .index import Index
+from .instrumentation import Instrumentation
+from .session import create_session
 
 
 class FreeTrade:
-    def __init__(self, email: str = None, ft_key_file: str = None, otp_parser: Callable = None):
+    def __init__(self, email: str = None, ft_key_file: str = None, otp_parser: Callable = None,
+                 session: requests.Session = None, index_cache_file: str = None,
+                 history_cache: HistoryCache = None, instrumentation: Instrumentation = None,
+                 lazy_auth: bool = True):
+        # lazy_auth: log in on the first authenticated call, instead of here
         # no key file given, look for one
         self.credentials = Credentials(ft_key_file)
+        # one pooled keep-alive session is shared by Auth, API and Index
+        self.session = session if session is not None else create_session(instrumentation=instrumentation)
+        if session is not None and instrumentation is not None:
+            # a custom session reports its responses too
+            instrumentation.instrument_session(session)
         self.auth = None
         self.api = None
-        self.index = Index(self.credentials)
+        self.index = Index(self.credentials, session=self.session, cache_file=index_cache_file)
         self.datastore = None
 
         if email is not None:
-            self.auth = Auth(self.credentials, email, otp_parser=otp_parser)
+            self.auth = Auth(self.credentials, email, otp_parser=otp_parser, session=self.session,
+                             instrumentation=instrumentation, lazy=lazy_auth)
 
-            self.api = API(self.auth, self.credentials.get_ft_api_host())
+            self.api = API(self.auth, self.credentials.get_ft_api_host(), session=self.session,
+                           cache=history_cache)
 
-            self.datastore = DataStore(self.api, self.index)
+            self.datastore = DataStore(self.api, self.index, instrumentation=instrumentation)
@@ -1,18 +1,45 @@
 import json
-from typing import Callable
+import logging
+import os
+import time
+from typing import Callable, Iterator
 
 import requests
 
-from freetrade import Credentials
+from .credentials import Credentials
+from .files import atomic_write
+from .catalogue import Asset, Catalogue
+from .instrumentation import Instrumentation
+from .session import create_session
+from .snapshot import Changes, Snapshot
+
+logger = logging.getLogger(__name__)
 
 
 class Index:
-    def __init__(self, credentials: Credentials):
+    # bumped when the format of the cache file changes
+    CACHE_VERSION = 1
+
+    def __init__(self, credentials: Credentials, session: requests.Session = None,
+                 cache_file: str = None, cache_ttl: float = 24 * 60 * 60, instrumentation: Instrumentation = None,
+                 snapshot_file: str = None):
+        # cache_file: if given, the browsed assets are persisted there and reused by new processes
+        # cache_ttl: seconds after which the cached assets are revalidated
+        # snapshot_file: if given, the snapshot of get_changes is persisted there
         self.credentials = credentials
+        self.session = session if session is not None else create_session(instrumentation=instrumentation)
+        self.cache_file = cache_file
+        self.cache_ttl = cache_ttl
+        self.hits = None
         self.assets = {}
-        self.host = 'https://{}-dsn.algolia.net'.format(credentials.get_algolia_application_id().lower())
+        self.catalogue = None
+        self.host = credentials.get_algolia_host()
+        self.snapshot_file = snapshot_file
+        self.snapshot = None
 
-    def get_assets_request(self, hits_per_page=30000, page=0) -> requests.Response:
+    def get_assets_request_args(self, hits_per_page=30000, page=0, extra_headers: dict = None,
+                                cursor: str = None) -> tuple:
+        # url, headers and data of the browse request
         url = self.host + '/1/indexes/' + self.credentials.get_algolia_index_name() + '/browse'
         headers = {
             'Content-Type': 'application/json',
@@ -20,21 +47,152 @@ class Index:
             'User-Agent': 'Algolia for Swift (6.1.1); iOS (12.2)',
             'X-Algolia-Application-Id': self.credentials.get_algolia_application_id(),
         }
+        if extra_headers is not None:
+            headers.update(extra_headers)
         data = {
             'params': f'hitsPerPage={hits_per_page}&page={page}&query='
         }
-        r = requests.get(url, headers=headers, data=data)
+        if cursor is not None:
+            data['cursor'] = cursor
+
+        return url, headers, data
+
+    def get_assets_request(self, hits_per_page=30000, page=0, extra_headers: dict = None,
+                           cursor: str = None) -> requests.Response:
+        url, headers, data = self.get_assets_request_args(hits_per_page, page, extra_headers, cursor)
+        r = self.session.get(url, headers=headers, data=data)
 
         return r
 
+    @staticmethod
+    def get_next_page(content: dict, page: int) -> tuple or None:
+        # (page, cursor) of the next browsed page, None after the last page
+        if content.get('cursor'):
+            return page, content['cursor']
+        if content.get('page', page) + 1 < content.get('nbPages', 0):
+            return content.get('page', page) + 1, None
+        return None
+
+    def browse(self, hits_per_page: int = 1000, extra_headers: dict = None) -> Iterator[tuple]:
+        # yields (response, content) of each browsed page, following Algolia's cursor (or page) model
+        # extra_headers are sent only with the first page, content is None for a 304 response
+        next_page = (0, None)
+        while next_page is not None:
+            page, cursor = next_page
+            r = self.get_assets_request(hits_per_page, page, extra_headers if next_page == (0, None) else None,
+                                        cursor)
+            if r.status_code == 304:
+                yield r, None
+                return
+            r.raise_for_status()
+
+            content = r.json()
+            yield r, content
+
+            next_page = self.get_next_page(content, page)
+
+    def load_cache(self) -> dict or None:
+        if self.cache_file is None or not os.path.isfile(self.cache_file):
+            return None
+
+        # if there are issues reading the cache, ignore it and download again
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+            if cache['version'] != self.CACHE_VERSION:
+                return None
+            return cache
+        except Exception as e:
+            logger.error('Error reading index cache: {} - {}.'.format(type(e).__name__, str(e)))
+            return None
+
+    def save_cache(self, hits: list, response: requests.Response = None):
+        if self.cache_file is None:
+            return
+
+        cache = {
+            'version': self.CACHE_VERSION,
+            'timestamp': time.time(),
+            'etag': None if response is None else response.headers.get('ETag'),
+            'last_modified': None if response is None else response.headers.get('Last-Modified'),
+            'hits': hits
+        }
+
+        atomic_write(self.cache_file, 'w', lambda f: json.dump(cache, f))
+
+    def get_hits(self, force: bool = False) -> list:
+        if self.hits is not None and not force:
+            return self.hits
+
+        self.hits = self.download_hits(force)
+        return self.hits
+
+    def is_cache_fresh(self, cache: dict or None) -> bool:
+        return cache is not None and time.time() - cache['timestamp'] < self.cache_ttl
+
+    def download_hits(self, force: bool = False) -> list:
+        cache = None if force else self.load_cache()
+        if self.is_cache_fresh(cache):
+            return cache['hits']
+
+        # revalidate the expired cache with a conditional request
+        extra_headers = {}
+        if cache is not None and cache['etag']:
+            extra_headers['If-None-Match'] = cache['etag']
+        if cache is not None and cache['last_modified']:
+            extra_headers['If-Modified-Since'] = cache['last_modified']
+
+        hits = []
+        first_response = None
+        for r, content in self.browse(extra_headers=extra_headers):
+            if content is None:
+                self.save_cache(cache['hits'], r)
+                return cache['hits']
+
+            first_response = r if first_response is None else first_response
+            hits.extend(content['hits'])
+
+        self.save_cache(hits, first_response)
+        return hits
+
+    def get_assets_iter(self, hits_per_page: int = 1000) -> Iterator[Asset]:
+        # yields the assets while they are browsed, and builds the catalogue on the fly
+        if self.catalogue is None and self.hits is None:
+            cache = self.load_cache()
+            if self.is_cache_fresh(cache):
+                self.hits = cache['hits']
+        if self.catalogue is None and self.hits is not None:
+            self.catalogue = Catalogue.from_hits(self.hits)
+
+        if self.catalogue is not None:
+            yield from self.catalogue
+            return
+
+        catalogue = Catalogue()
+        hits = []
+        first_response = None
+        for r, content in self.browse(hits_per_page):
+            first_response = r if first_response is None else first_response
+            for hit in content['hits']:
+                asset = Catalogue.asset_from_hit(hit)
+                catalogue.add(asset)
+                # the raw hits are kept for get_hits, get_assets and get_changes, and the cache file
+                hits.append(hit)
+                yield asset
+
+        self.catalogue = catalogue
+        self.hits = hits
+        self.save_cache(hits, first_response)
+
     def get_assets(self) -> dict:
         if len(self.assets) > 0:
             return self.assets
 
-        r = self.get_assets_request()
-
-        response = json.loads(r.text)['hits']
+        self.assets = self.build_assets(self.get_hits())
+        return self.assets
 
+    @staticmethod
+    def build_assets(response: list) -> dict:
         assets = {
             'currency': {},
             'exchange': {},
@@ -48,22 +206,52 @@ class Index:
                 if response_item[type] not in assets[type]:
                     assets[type][response_item[type]] = []
                 assets[type][response_item[type]].append(response_item)
-                ticker[response_item['symbol']] = response_item
+            ticker[response_item['symbol']] = response_item
 
         assets['all'] = ticker
-        self.assets = assets
         return assets
 
-    def get_tickers(self) -> dict:
-        assets = self.get_assets()
-        tickers = {}
+    def get_catalogue(self) -> Catalogue:
+        if self.catalogue is None:
+            self.catalogue = Catalogue.from_hits(self.get_hits())
+        return self.catalogue
+
+    def refresh(self) -> dict:
+        # downloads the assets again, bypassing the cache
+        hits = self.get_hits(force=True)
+        self.assets = self.build_assets(hits)
+        self.catalogue = Catalogue.from_hits(hits)
+        return self.assets
+
+    def get_changes(self, force: bool = False) -> Changes:
+        # the assets added, removed and changed since the previous call (or the snapshot file),
+        # the current assets become the snapshot of the next call
+        # force: download the assets again, instead of using the loaded or cached ones
+        if force:
+            self.refresh()
+        hits = self.get_hits()
 
-        for ftmarket, assets in assets['exchange'].items():
-            tickers[ftmarket] = []
-            for asset in assets:
-                tickers[ftmarket].append(asset['symbol'])
+        previous = self.snapshot
+        if previous is None and self.snapshot_file is not None:
+            # if there are issues reading the snapshot, all assets are reported as added
+            try:
+                previous = Snapshot.load(self.snapshot_file)
+            except Exception as e:
+                logger.error('Error reading index snapshot: {} - {}.'.format(type(e).__name__, str(e)))
+
+        current = Snapshot.from_hits(hits)
+        changes = (previous if previous is not None else Snapshot()).diff(current)
+
+        self.snapshot = current
+        if self.snapshot_file is not None:
+            current.save(self.snapshot_file)
+        return changes
+
+    def get_tickers(self) -> dict:
+        catalogue = self.get_catalogue()
 
-        return tickers
+        return {ftmarket: [asset.symbol for asset in catalogue.filter(exchange=ftmarket)]
+                for ftmarket in catalogue.get_values('exchange')}
 
     def get_tradingview_tickers(self, join_exchanges: bool = False) -> dict or str:
         tickers = self.get_tickers()
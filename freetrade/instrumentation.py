@@ -0,0 +1,145 @@
+import logging
+import socket
+import threading
+import time
+from collections import namedtuple, deque
+from contextlib import contextmanager
+from typing import Callable
+
+import requests
+
+from .ratelimit import get_upstream
+
+logger = logging.getLogger(__name__)
+
+# kind: 'request', 'token_refresh' or 'datastore'
+# name: upstream of a request (see ratelimit.get_upstream), or the phase, e.g. 'datastore.write'
+# status: HTTP status code of a request, 'ok' or 'error' otherwise
+Event = namedtuple('Event', ['kind', 'name', 'status', 'latency', 'bytes_in', 'bytes_out', 'request_id', 'extra'])
+
+
+class Instrumentation:
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback: Callable[[Event], None]):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Event], None]):
+        self.subscribers.remove(callback)
+
+    def emit(self, event: Event):
+        for callback in self.subscribers:
+            # a failing subscriber never fails the instrumented call
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error('Error in instrumentation subscriber: {} - {}.'.format(type(e).__name__, str(e)))
+
+    @contextmanager
+    def span(self, kind: str, name: str, **extra):
+        # times the block, which may add details to the yielded extra dictionary
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield extra
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self.emit(Event(kind, name, status, time.perf_counter() - start, extra.pop('bytes_in', 0),
+                            extra.pop('bytes_out', 0), extra.pop('request_id', None), extra))
+
+    def on_response(self, response: requests.Response, *args, **kwargs):
+        # requests response hook
+        request = response.request
+        body = request.body
+        bytes_out = len(body) if body is not None else 0
+        self.emit(Event(
+            kind='request',
+            name=get_upstream(request.url),
+            status=response.status_code,
+            latency=response.elapsed.total_seconds(),
+            bytes_in=len(response.content),
+            bytes_out=bytes_out,
+            request_id=request.headers.get('request_id'),
+            extra={'method': request.method, 'endpoint': request.path_url.split('?')[0]}
+        ))
+
+    def instrument_session(self, session: requests.Session):
+        # a session instrumented already, e.g. by create_session, is not hooked twice
+        if self.on_response not in session.hooks['response']:
+            session.hooks['response'].append(self.on_response)
+
+
+@contextmanager
+def span(instrumentation: Instrumentation or None, kind: str, name: str, **extra):
+    # a span, which does nothing without instrumentation
+    if instrumentation is None:
+        yield extra
+    else:
+        with instrumentation.span(kind, name, **extra) as extra:
+            yield extra
+
+
+class MetricsCollector:
+    def __init__(self, max_events: int = 1000):
+        # max_events: number of the latest events kept
+        self.events = deque(maxlen=max_events)
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event: Event):
+        key = (event.kind, event.name, str(event.status))
+        with self.lock:
+            self.events.append(event)
+            metric = self.metrics.setdefault(key, {
+                'count': 0,
+                'latency_sum': 0.0,
+                'latency_max': 0.0,
+                'bytes_in': 0,
+                'bytes_out': 0
+            })
+            metric['count'] += 1
+            metric['latency_sum'] += event.latency
+            metric['latency_max'] = max(metric['latency_max'], event.latency)
+            metric['bytes_in'] += event.bytes_in
+            metric['bytes_out'] += event.bytes_out
+
+    def get_metrics(self) -> dict:
+        # (kind, name, status) -> count, latency_sum, latency_max, bytes_in, bytes_out
+        with self.lock:
+            return {key: dict(metric) for key, metric in self.metrics.items()}
+
+    def to_prometheus(self, prefix: str = 'freetrade') -> str:
+        lines = []
+        metrics = self.get_metrics()
+        for field, metric_type in (('count', 'counter'), ('latency_sum', 'counter'), ('latency_max', 'gauge'),
+                                   ('bytes_in', 'counter'), ('bytes_out', 'counter')):
+            metric_name = f'{prefix}_{field}'
+            lines.append(f'# TYPE {metric_name} {metric_type}')
+            for (kind, name, status), metric in sorted(metrics.items()):
+                labels = f'kind="{kind}",name="{name}",status="{status}"'
+                lines.append(f'{metric_name}{{{labels}}} {metric[field]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdExporter:
+    def __init__(self, host: str = '127.0.0.1', port: int = 8125, prefix: str = 'freetrade'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, event: Event):
+        name = f'{self.prefix}.{event.kind}.{event.name}'.replace('/', '_')
+        lines = [
+            f'{name}.count.{event.status}:1|c',
+            f'{name}.latency:{event.latency * 1000:.3f}|ms',
+            f'{name}.bytes_in:{event.bytes_in}|c',
+            f'{name}.bytes_out:{event.bytes_out}|c'
+        ]
+        self.socket.sendto('\n'.join(lines).encode(), self.address)
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,195 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+# requests per second, which are allowed to each upstream by default
+DEFAULT_RATES = {
+    'iex': 20.0,
+    'quandl': 10.0,
+    'algolia': 10.0,
+    'google': 5.0,
+    'default': 20.0
+}
+
+
+def get_upstream(url: str) -> str:
+    parsed = urlparse(url)
+    if 'algolia' in parsed.netloc:
+        return 'algolia'
+    if parsed.netloc.endswith('googleapis.com'):
+        return 'google'
+    if parsed.path.startswith('/proxy/iex/'):
+        return 'iex'
+    if parsed.path.startswith('/proxy/quandl/'):
+        return 'quandl'
+    return 'default'
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = None):
+        # rate: tokens added per second, capacity: burst size
+        # the rate adapts between min_rate and the initial rate
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate / 16 if min_rate is None else min_rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # takes a token, and returns the seconds to wait before using it
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def block(self, seconds: float):
+        # e.g. after a 429 Too Many Requests response with a Retry-After header
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def decrease_rate(self):
+        # multiplicative decrease on throttling
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def increase_rate(self):
+        # additive increase on success
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class RateLimiter:
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # requests which are safe to send again after a server error
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, rates: dict = None, max_retries: int = 5, backoff_factor: float = 0.5,
+                 max_backoff: float = 60.0):
+        # rates: upstream -> requests per second, see DEFAULT_RATES
+        # max_retries: number of retries after a 429 or 5xx response
+        # backoff_factor: the n-th retry waits up to backoff_factor * 2 ** n seconds, unless Retry-After is given
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        self.buckets = {upstream: TokenBucket(rate) for upstream, rate in self.rates.items()}
+        self.lock = threading.Lock()
+        self.counters = {upstream: self.new_counters() for upstream in self.rates}
+
+    @staticmethod
+    def new_counters() -> dict:
+        return {
+            'requests': 0,
+            'throttled': 0,
+            'throttled_seconds': 0.0,
+            'retries': 0,
+            'too_many_requests': 0,
+            'server_errors': 0
+        }
+
+    @staticmethod
+    def get_upstream(url: str) -> str:
+        return get_upstream(url)
+
+    def count(self, upstream: str, counter: str, value: float = 1):
+        with self.lock:
+            self.counters[upstream][counter] += value
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = {upstream: dict(counters) for upstream, counters in self.counters.items()}
+        for upstream, bucket in self.buckets.items():
+            stats[upstream]['rate'] = bucket.rate
+        return stats
+
+    def acquire(self, upstream: str):
+        waited = self.buckets[upstream].acquire()
+        self.count(upstream, 'requests')
+        if waited > 0:
+            self.count(upstream, 'throttled')
+            self.count(upstream, 'throttled_seconds', waited)
+
+    def get_retry_after(self, response: requests.Response) -> float or None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is None:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def get_backoff(self, attempt: int, response: requests.Response) -> float:
+        retry_after = self.get_retry_after(response)
+        if retry_after is not None:
+            # a little jitter, so that the waiting requests do not retry at once
+            return min(retry_after + random.uniform(0, self.backoff_factor), self.max_backoff)
+
+        # full jitter exponential backoff
+        return random.uniform(0, min(self.backoff_factor * 2 ** attempt, self.max_backoff))
+
+    def should_retry(self, method: str, response: requests.Response, attempt: int) -> bool:
+        if attempt >= self.max_retries or response.status_code not in self.RETRY_STATUSES:
+            return False
+        # a 429 response means the request was not processed
+        return response.status_code == 429 or method.upper() in self.IDEMPOTENT_METHODS
+
+    def on_response(self, upstream: str, response: requests.Response):
+        bucket = self.buckets[upstream]
+        if response.status_code == 429:
+            self.count(upstream, 'too_many_requests')
+            bucket.decrease_rate()
+        elif response.status_code >= 500:
+            self.count(upstream, 'server_errors')
+        else:
+            bucket.increase_rate()
+
+
+class RateLimitedSession(requests.Session):
+    def __init__(self, rate_limiter: RateLimiter):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+
+    def request(self, method: str, url: str, *args, **kwargs) -> requests.Response:
+        limiter = self.rate_limiter
+        upstream = limiter.get_upstream(url)
+
+        attempt = 0
+        while True:
+            limiter.acquire(upstream)
+            response = super().request(method, url, *args, **kwargs)
+            limiter.on_response(upstream, response)
+
+            if not limiter.should_retry(method, response, attempt):
+                return response
+
+            backoff = limiter.get_backoff(attempt, response)
+            if response.status_code == 429:
+                # hold back the other requests to this upstream too
+                limiter.buckets[upstream].block(backoff)
+            limiter.count(upstream, 'retries')
+            response.close()
+            time.sleep(backoff)
+            attempt += 1
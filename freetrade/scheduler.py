@@ -0,0 +1,134 @@
+import argparse
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+
+from .api import IEX_BATCH_SIZE
+from .calendars import ExchangeCalendar, get_calendar
+from .datastore import DataStore
+from .freetrade import FreeTrade
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    def __init__(self, datastore: DataStore, directory: str = 'history', calendars: dict = None, workers: int = 1,
+                 max_per_host: int = 8, batch_size: int = IEX_BATCH_SIZE, chunk_size: int = 500,
+                 retry_interval: float = 15 * 60, index_ttl: float = 24 * 60 * 60):
+        # calendars: exchange -> ExchangeCalendar, overriding the calendars of freetrade.calendars
+        # workers, max_per_host, batch_size: see DataStore.update_historical_prices
+        # chunk_size: number of the most stale tickers updated at a time
+        # retry_interval: seconds until the next run of run_forever after errors
+        # index_ttl: seconds after which run_forever downloads the assets again
+        self.datastore = datastore
+        self.directory = directory
+        self.calendars = {} if calendars is None else calendars
+        self.workers = workers
+        self.max_per_host = max_per_host
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.retry_interval = retry_interval
+        self.index_ttl = index_ttl
+        self.stop_event = threading.Event()
+
+    def get_calendar(self, exchange: str) -> ExchangeCalendar:
+        return self.calendars.get(exchange) or get_calendar(exchange)
+
+    def get_queue(self, now: datetime = None) -> list:
+        # heap of (-staleness, ticker, exchange) of the tickers, which may have new prices upstream
+        # staleness: number of the closed sessions after the stored last date, infinite for a new ticker
+        # only the stored last dates are read, no requests are made
+        latest_sessions = {}
+        queue = []
+        for asset in self.datastore.index.get_catalogue():
+            calendar = self.get_calendar(asset.exchange)
+            if asset.exchange not in latest_sessions:
+                latest_sessions[asset.exchange] = calendar.get_last_closed_session(now)
+
+            last_date = self.datastore.get_last_date(asset.symbol, self.directory)
+            if last_date is None:
+                staleness = float('inf')
+            else:
+                staleness = calendar.count_sessions(last_date, latest_sessions[asset.exchange])
+                if staleness == 0:
+                    continue
+            heapq.heappush(queue, (-staleness, asset.symbol, asset.exchange))
+
+        return queue
+
+    def run_once(self, now: datetime = None) -> dict:
+        # updates the stale tickers, the most stale first, returns the report of DataStore.update_historical_prices
+        # with the number of the skipped up to date tickers
+        queue = self.get_queue(now)
+        report = {
+            'updated': {},
+            'errors': {},
+            'timings': {},
+            'skipped': len(self.datastore.index.get_catalogue()) - len(queue)
+        }
+
+        while queue and not self.stop_event.is_set():
+            chunk = [heapq.heappop(queue)[1] for _ in range(min(self.chunk_size, len(queue)))]
+            chunk_report = self.datastore.update_historical_prices(self.directory, self.workers, self.max_per_host,
+                                                                   self.batch_size, tickers=chunk)
+            for key in ('updated', 'errors', 'timings'):
+                report[key].update(chunk_report[key])
+
+        logger.info('Updated {} tickers, skipped {} up to date tickers, {} errors.'.format(
+            len(report['updated']), report['skipped'], len(report['errors'])))
+        return report
+
+    def get_next_run_time(self, now: datetime = None) -> datetime:
+        # when the prices of the next session of any exchange are expected upstream
+        exchanges = self.datastore.index.get_catalogue().get_values('exchange')
+        return min(self.get_calendar(exchange).get_next_available_time(now) for exchange in exchanges)
+
+    def run_forever(self):
+        # runs until stop is called, waking up when new prices are expected, or to retry the errors
+        self.stop_event.clear()
+        index_time = time.time()
+        while not self.stop_event.is_set():
+            try:
+                if time.time() - index_time > self.index_ttl:
+                    self.datastore.index.refresh()
+                    index_time = time.time()
+
+                report = self.run_once()
+                next_run_time = self.get_next_run_time()
+                wait = max((next_run_time - datetime.now(next_run_time.tzinfo)).total_seconds(), 0)
+                if report['errors']:
+                    wait = min(wait, self.retry_interval)
+            except Exception as e:
+                logger.error('Error refreshing prices: {} - {}.'.format(type(e).__name__, str(e)))
+                wait = self.retry_interval
+
+            self.stop_event.wait(min(wait, self.index_ttl))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description='Updates the stored prices of the tickers with new sessions.')
+    parser.add_argument('--email', required=True, help='email of the Freetrade account')
+    parser.add_argument('--keys', help='ft-keys.json file')
+    parser.add_argument('--directory', default='history', help='directory of the price history')
+    parser.add_argument('--index-cache', help='cache file of the assets, so that a run without stale tickers '
+                                              'makes no requests')
+    parser.add_argument('--workers', type=int, default=8, help='workers of DataStore.update_historical_prices')
+    parser.add_argument('--daemon', action='store_true', help='keep running, and update at each exchange close')
+    options = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+    ft = FreeTrade(options.email, options.keys, index_cache_file=options.index_cache)
+    scheduler = RefreshScheduler(ft.datastore, options.directory, workers=options.workers)
+    if options.daemon:
+        scheduler.run_forever()
+    else:
+        scheduler.run_once()
+
+
+if __name__ == '__main__':
+    main()
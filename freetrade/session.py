@@ -0,0 +1,40 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .instrumentation import Instrumentation
+from .ratelimit import RateLimiter, RateLimitedSession
+
+
+def create_session(pool_connections: int = 10, pool_maxsize: int = 10, max_retries: int = 3,
+                   backoff_factor: float = 0.3, pool_block: bool = False,
+                   rate_limiter: RateLimiter or bool = True,
+                   instrumentation: Instrumentation = None) -> requests.Session:
+    # pool_connections: number of hosts to keep connection pools for
+    # pool_maxsize: number of kept-alive connections per host
+    # max_retries, backoff_factor: retry failed idempotent requests with exponential backoff
+    # rate_limiter: per upstream rate limits with adaptive backoff on 429 and 5xx responses,
+    # True for the default limits, False to disable
+    # instrumentation: receives an event for every response
+    if rate_limiter is True:
+        rate_limiter = RateLimiter(max_retries=max_retries, backoff_factor=backoff_factor)
+
+    # with a rate limiter, it retries on the status codes, and urllib3 only on the connection errors
+    retry = Retry(total=max_retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=() if rate_limiter else (500, 502, 503, 504),
+                  respect_retry_after_header=not rate_limiter,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          max_retries=retry,
+                          pool_block=pool_block)
+
+    session = RateLimitedSession(rate_limiter) if rate_limiter else requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if instrumentation is not None:
+        instrumentation.instrument_session(session)
+
+    return session
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import time
+
+from .catalogue import Asset, Catalogue
+from .files import atomic_write
+
+
+def get_hit_key(hit: dict) -> str:
+    # Algolia's objectID, else the ISIN, else exchange:symbol of the hits without both
+    return hit.get('objectID') or hit.get('isin') or hit['exchange'] + ':' + hit['symbol']
+
+
+def hash_hit(hit: dict) -> str:
+    # the hash of all fields of a hit, except Algolia's metadata, e.g. _highlightResult
+    record = {key: value for key, value in hit.items() if not key.startswith('_')}
+    return hashlib.sha1(json.dumps(record, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class Changes:
+    # the difference of two snapshots of the assets
+    def __init__(self, added: set, removed: set, changed: set, previous: dict, current: dict):
+        # added, removed, changed: keys of the assets, see get_hit_key
+        # previous, current: key -> Asset of the older and the newer snapshot
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.previous = previous
+        self.current = current
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def get_added_assets(self) -> list:
+        return [self.current[key] for key in sorted(self.added)]
+
+    def get_removed_assets(self) -> list:
+        return [self.previous[key] for key in sorted(self.removed)]
+
+    def get_changed_assets(self) -> list:
+        return [self.current[key] for key in sorted(self.changed)]
+
+    def get_changed_fields(self, key: str) -> dict:
+        # field -> (previous, current) value of a changed asset, e.g. {'isa_eligible': (True, False)}
+        # empty, if only the fields outside Asset (e.g. the logo) changed
+        previous, current = self.previous[key], self.current[key]
+        return {field: (getattr(previous, field), getattr(current, field))
+                for field in Asset._fields if getattr(previous, field) != getattr(current, field)}
+
+    def filter_changed(self, field: str) -> list:
+        # the changed assets, whose field changed, e.g. 'isa_eligible'
+        return [self.current[key] for key in sorted(self.changed) if field in self.get_changed_fields(key)]
+
+
+class Snapshot:
+    # key -> (hash, Asset) of each asset, persisted as JSON
+    VERSION = 1
+
+    def __init__(self, records: dict = None, timestamp: float = None):
+        self.records = {} if records is None else records
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @staticmethod
+    def from_hits(hits: list) -> 'Snapshot':
+        return Snapshot({get_hit_key(hit): (hash_hit(hit), Catalogue.asset_from_hit(hit)) for hit in hits})
+
+    @staticmethod
+    def load(path: str) -> 'Snapshot' or None:
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, 'r') as f:
+            snapshot = json.load(f)
+        if snapshot['version'] != Snapshot.VERSION:
+            return None
+        return Snapshot({key: (record['hash'], Asset(*record['asset'])) for key, record in snapshot['records'].items()},
+                        snapshot['timestamp'])
+
+    def save(self, path: str):
+        snapshot = {
+            'version': self.VERSION,
+            'timestamp': self.timestamp,
+            'records': {key: {'hash': record_hash, 'asset': list(asset)}
+                        for key, (record_hash, asset) in self.records.items()}
+        }
+
+        atomic_write(path, 'w', lambda f: json.dump(snapshot, f))
+
+    def diff(self, current: 'Snapshot') -> Changes:
+        # the changes from this snapshot to the current one, only the hashes are compared
+        previous_keys, current_keys = self.records.keys(), current.records.keys()
+        changed = {key for key in previous_keys & current_keys
+                   if self.records[key][0] != current.records[key][0]}
+
+        return Changes(
+            added=set(current_keys - previous_keys),
+            removed=set(previous_keys - current_keys),
+            changed=changed,
+            previous={key: asset for key, (_, asset) in self.records.items()},
+            current={key: asset for key, (_, asset) in current.records.items()}
+        )
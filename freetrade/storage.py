@@ -0,0 +1,469 @@
+import csv
+import glob
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import date
+from typing import Iterator
+
+import numpy as np
+
+from .files import atomic_write
+
+# one record per trading day: days since epoch and the adjusted closing price
+HISTORY_DTYPE = np.dtype([('date', 'M8[D]'), ('close', 'f8')])
+
+
+def columns_to_array(dates: list or tuple, prices: list or tuple) -> np.ndarray:
+    data = np.empty(len(dates), dtype=HISTORY_DTYPE)
+    data['date'] = np.array(dates, dtype='M8[D]')
+    # missing prices (None) become nan
+    data['close'] = np.array(prices, dtype='f8')
+    return data
+
+
+def rows_to_array(rows: list) -> np.ndarray:
+    # rows of (date, price)
+    return columns_to_array(*zip(*rows)) if rows else columns_to_array([], [])
+
+
+def array_to_prices(data: np.ndarray) -> OrderedDict:
+    return OrderedDict(zip(data['date'].astype(str).tolist(), data['close'].tolist()))
+
+
+def to_date(value: str or date or np.datetime64 or None) -> np.datetime64 or None:
+    return None if value is None else np.datetime64(value, 'D')
+
+
+def select_dates(data: np.ndarray, start: np.datetime64 = None, end: np.datetime64 = None) -> np.ndarray:
+    # records within the inclusive date range
+    if start is not None:
+        data = data[data['date'] >= start]
+    if end is not None:
+        data = data[data['date'] <= end]
+    return data
+
+
+class Storage(ABC):
+    # a backend implements load, write and append, the rest have defaults built on them
+    extension = ''
+
+    def get_path(self, ticker: str, directory: str = 'history') -> str:
+        return directory + os.sep + ticker + self.extension
+
+    def get_tickers(self, directory: str = 'history') -> list:
+        files = glob.glob(directory + os.sep + '*' + self.extension)
+        return sorted(os.path.basename(file)[:-len(self.extension)] for file in files)
+
+    def exists(self, ticker: str, directory: str = 'history') -> bool:
+        return os.path.isfile(self.get_path(ticker, directory))
+
+    @abstractmethod
+    def load(self, ticker: str, directory: str = 'history') -> np.ndarray:
+        pass
+
+    def get_last_date(self, ticker: str, directory: str = 'history') -> np.datetime64 or None:
+        data = self.load(ticker, directory)
+        return data['date'][-1] if len(data) else None
+
+    def load_tail(self, ticker: str, directory: str = 'history', rows: int = 1) -> np.ndarray:
+        # the last rows of the history
+        return self.load(ticker, directory)[-rows:]
+
+    @abstractmethod
+    def write(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        pass
+
+    @abstractmethod
+    def append(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        pass
+
+    def flush(self, directory: str = 'history'):
+        # called after a batch of writes, e.g. by DataStore.update_historical_prices
+        pass
+
+    def scan(self, directory: str = 'history', tickers: list = None, start: str or date = None,
+             end: str or date = None, workers: int = 8, chunk_size: int = 256) -> Iterator[OrderedDict]:
+        # lazily yields chunks of ticker -> history within the inclusive date range,
+        # the files of each chunk are read by a thread pool
+        tickers = self.get_tickers(directory) if tickers is None else list(tickers)
+        start, end = to_date(start), to_date(end)
+
+        def load(ticker: str) -> np.ndarray:
+            # a ticker without a stored history is empty, as in ShardedStorage
+            if not self.exists(ticker, directory):
+                return np.empty(0, dtype=HISTORY_DTYPE)
+            return select_dates(self.load(ticker, directory), start, end)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(0, len(tickers), chunk_size):
+                chunk = tickers[i:i + chunk_size]
+                yield OrderedDict(zip(chunk, executor.map(load, chunk)))
+
+
+class CsvStorage(Storage):
+    # history/<TICKER>.csv with YYYY-MM-DD,price lines
+    extension = '.csv'
+
+    def load(self, ticker: str, directory: str = 'history') -> np.ndarray:
+        with open(self.get_path(ticker, directory), 'r') as f:
+            return rows_to_array(list(csv.reader(f)))
+
+    def get_last_date(self, ticker: str, directory: str = 'history') -> np.datetime64 or None:
+        # only the tail of the file is read, lines are about 20 characters long
+        with open(self.get_path(ticker, directory), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - 256, 0))
+            lines = f.read().split()
+
+        if not lines:
+            return None
+        return np.datetime64(lines[-1].split(b',')[0].decode(), 'D')
+
+    def write(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        os.makedirs(directory, exist_ok=True)
+        with open(self.get_path(ticker, directory), 'w') as f:
+            csv.writer(f).writerows(zip(data['date'].astype(str), data['close'].tolist()))
+
+    def append(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        os.makedirs(directory, exist_ok=True)
+        with open(self.get_path(ticker, directory), 'a') as f:
+            csv.writer(f).writerows(zip(data['date'].astype(str), data['close'].tolist()))
+
+
+class BinaryStorage(Storage):
+    # history/<TICKER>.bin with packed HISTORY_DTYPE records, 16 bytes per trading day
+    extension = '.bin'
+
+    def load(self, ticker: str, directory: str = 'history', mmap: bool = False) -> np.ndarray:
+        path = self.get_path(ticker, directory)
+        # memory mapping an empty file is not supported
+        if mmap and os.path.getsize(path) > 0:
+            return np.memmap(path, dtype=HISTORY_DTYPE, mode='r')
+        return np.fromfile(path, dtype=HISTORY_DTYPE)
+
+    def get_last_date(self, ticker: str, directory: str = 'history') -> np.datetime64 or None:
+        # only the last record is read
+        with open(self.get_path(ticker, directory), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < HISTORY_DTYPE.itemsize:
+                return None
+            f.seek(-HISTORY_DTYPE.itemsize, os.SEEK_END)
+            return np.frombuffer(f.read(HISTORY_DTYPE.itemsize), dtype=HISTORY_DTYPE)['date'][0]
+
+    def load_tail(self, ticker: str, directory: str = 'history', rows: int = 1) -> np.ndarray:
+        # only the last records are read
+        with open(self.get_path(ticker, directory), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() // HISTORY_DTYPE.itemsize - rows, 0) * HISTORY_DTYPE.itemsize)
+            return np.frombuffer(f.read(), dtype=HISTORY_DTYPE).copy()
+
+    def write(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        os.makedirs(directory, exist_ok=True)
+        np.ascontiguousarray(data, dtype=HISTORY_DTYPE).tofile(self.get_path(ticker, directory))
+
+    def append(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        os.makedirs(directory, exist_ok=True)
+        with open(self.get_path(ticker, directory), 'ab') as f:
+            f.write(np.ascontiguousarray(data, dtype=HISTORY_DTYPE).tobytes())
+
+    def import_csv(self, directory: str = 'history', csv_directory: str = None) -> list:
+        # converts the CSV layout of csv_directory (by default the same directory) into binary files
+        csv_storage = CsvStorage()
+        csv_directory = directory if csv_directory is None else csv_directory
+
+        tickers = csv_storage.get_tickers(csv_directory)
+        for ticker in tickers:
+            self.write(csv_storage.load(ticker, csv_directory), ticker, directory)
+
+        return tickers
+
+
+# one record per ticker and trading day in the shards of ShardedStorage, 28 bytes each
+SHARD_DTYPE = np.dtype([('ticker', 'S12'), ('date', 'M8[D]'), ('close', 'f8')])
+
+
+def read_shard(path: str, tickers: list = None, start: np.datetime64 = None,
+               end: np.datetime64 = None) -> OrderedDict:
+    # ticker -> history of one shard, only of the tickers and within the inclusive date range
+    # a module level function, so that it can run in a process pool
+    records = select_dates(np.fromfile(path, dtype=SHARD_DTYPE), start, end)
+    if tickers is not None:
+        records = records[np.isin(records['ticker'], np.array(tickers, dtype=SHARD_DTYPE['ticker']))]
+
+    if len(records) == 0:
+        return OrderedDict()
+
+    # records are in the order of writing, sort them by ticker and date on one integer key,
+    # and keep the last written record of a duplicate date
+    # appends write runs of one ticker, so the tickers are coded by their runs instead of sorting the strings
+    tickers = records['ticker']
+    heads = np.flatnonzero(np.concatenate(([True], tickers[1:] != tickers[:-1])))
+    symbols = OrderedDict()
+    run_codes = [symbols.setdefault(symbol, len(symbols)) for symbol in tickers[heads].tolist()]
+    codes = np.repeat(np.array(run_codes, dtype='i8'), np.diff(np.append(heads, len(tickers))))
+    days = records['date'].astype('i8')
+    keys = (codes << 32) | (days - days.min())
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    keep = np.ones(len(keys), dtype=bool)
+    keep[:-1] = keys[1:] != keys[:-1]
+    order = order[keep]
+
+    data = np.empty(len(order), dtype=HISTORY_DTYPE)
+    data['date'] = records['date'][order]
+    data['close'] = records['close'][order]
+    ends = np.cumsum(np.bincount(codes[order], minlength=len(symbols))).tolist()
+
+    histories = OrderedDict()
+    for symbol, first, last in zip(symbols, [0] + ends[:-1], ends):
+        histories[symbol.decode()] = data[first:last]
+
+    return histories
+
+
+class ShardedStorage(Storage):
+    # history/<EXCHANGE>/<YEAR>.bin with packed SHARD_DTYPE records of all tickers of the exchange,
+    # and history/manifest.json with ticker -> exchange, first and last date, number of records
+    # a directory is written by one process at a time
+    extension = '.bin'
+    manifest_file = 'manifest.json'
+
+    def __init__(self):
+        # directory -> (manifest, stat of the manifest file, stats of the shards of a rebuilt manifest or None),
+        # and the directories with unsaved manifests
+        self.manifests = {}
+        self.dirty = set()
+        self.lock = threading.RLock()
+
+    def get_path(self, ticker: str, directory: str = 'history') -> str:
+        return directory + os.sep + self.manifest_file
+
+    def get_shard_path(self, exchange: str, year: int, directory: str = 'history') -> str:
+        return directory + os.sep + exchange + os.sep + str(year) + self.extension
+
+    def get_shards(self, directory: str = 'history') -> list:
+        # (exchange, year, path) of all shards
+        shards = []
+        for path in glob.glob(directory + os.sep + '*' + os.sep + '*' + self.extension):
+            exchange = os.path.basename(os.path.dirname(path))
+            year = os.path.basename(path)[:-len(self.extension)]
+            if year.isdigit():
+                shards.append((exchange, int(year), path))
+        return sorted(shards)
+
+    @staticmethod
+    def get_stat(path: str) -> tuple or None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_manifest(self, directory: str = 'history') -> dict:
+        with self.lock:
+            path = self.get_path('', directory)
+            if directory in self.dirty:
+                return self.manifests[directory][0]
+
+            stat = self.get_stat(path)
+            cached = self.manifests.get(directory)
+            if cached is not None and cached[1] == stat and cached[2] is None:
+                return cached[0]
+
+            shards = self.get_shards_stat(directory)
+            # a rebuilt manifest is valid, until the manifest file or a shard changes
+            if cached is not None and cached[1] == stat and cached[2] == shards:
+                return cached[0]
+
+            # the manifest is stale, if a shard was written after it, e.g. by an interrupted update
+            if stat is not None and all(shard_stat[0] <= stat[0] for _, shard_stat in shards):
+                with open(path, 'r') as f:
+                    manifest = json.load(f)['tickers']
+                self.manifests[directory] = (manifest, stat, None)
+                return manifest
+
+            return self.rebuild_manifest(directory, stat, shards)
+
+    def get_shards_stat(self, directory: str = 'history') -> tuple:
+        return tuple((path, self.get_stat(path)) for _, _, path in self.get_shards(directory))
+
+    def rebuild_manifest(self, directory: str = 'history', stat: tuple = None, shards: tuple = None) -> dict:
+        # recreates the manifest from the shards in memory, it is saved by the next flush after a write,
+        # so that a reader never writes the manifest of a directory being updated by another process
+        with self.lock:
+            manifest = {}
+            for exchange, year, path in self.get_shards(directory):
+                for ticker, data in read_shard(path).items():
+                    self.update_entry(manifest, ticker, exchange, data)
+
+            shards = self.get_shards_stat(directory) if shards is None else shards
+            self.manifests[directory] = (manifest, stat, shards)
+            return manifest
+
+    @staticmethod
+    def update_entry(manifest: dict, ticker: str, exchange: str, data: np.ndarray):
+        first, last = str(data['date'].min()), str(data['date'].max())
+        entry = manifest.setdefault(ticker, {'exchange': exchange, 'first': first, 'last': last, 'rows': 0})
+        entry['first'] = min(entry['first'], first)
+        entry['last'] = max(entry['last'], last)
+        entry['rows'] += len(data)
+
+    def flush(self, directory: str = 'history'):
+        with self.lock:
+            if directory not in self.dirty:
+                return
+
+            manifest = self.manifests[directory][0]
+            path = self.get_path('', directory)
+            atomic_write(path, 'w', lambda f: json.dump({'version': 1, 'tickers': manifest}, f))
+
+            self.manifests[directory] = (manifest, self.get_stat(path), None)
+            self.dirty.discard(directory)
+
+    def get_tickers(self, directory: str = 'history') -> list:
+        return sorted(self.get_manifest(directory))
+
+    def exists(self, ticker: str, directory: str = 'history') -> bool:
+        return ticker in self.get_manifest(directory)
+
+    def get_last_date(self, ticker: str, directory: str = 'history') -> np.datetime64 or None:
+        # read from the manifest only
+        entry = self.get_manifest(directory).get(ticker)
+        return None if entry is None else np.datetime64(entry['last'], 'D')
+
+    def get_ticker_shards(self, ticker: str, directory: str = 'history') -> list:
+        # paths of the existing shards, which may contain the ticker
+        entry = self.get_manifest(directory)[ticker]
+        paths = [self.get_shard_path(entry['exchange'], year, directory)
+                 for year in range(int(entry['first'][:4]), int(entry['last'][:4]) + 1)]
+        return [path for path in paths if os.path.isfile(path)]
+
+    def load(self, ticker: str, directory: str = 'history') -> np.ndarray:
+        if not self.exists(ticker, directory):
+            raise FileNotFoundError(f'No history of {ticker} in {directory}')
+
+        histories = [read_shard(path, [ticker]).get(ticker) for path in self.get_ticker_shards(ticker, directory)]
+        histories = [history for history in histories if history is not None]
+        return np.concatenate(histories) if histories else np.empty(0, dtype=HISTORY_DTYPE)
+
+    def load_tail(self, ticker: str, directory: str = 'history', rows: int = 1) -> np.ndarray:
+        # only the latest shards of the ticker, which hold the last rows, are read
+        histories = []
+        for path in reversed(self.get_ticker_shards(ticker, directory)):
+            history = read_shard(path, [ticker]).get(ticker)
+            if history is not None:
+                histories.insert(0, history)
+                rows_read = sum(len(history) for history in histories)
+                if rows_read >= rows:
+                    break
+        return np.concatenate(histories)[-rows:] if histories else np.empty(0, dtype=HISTORY_DTYPE)
+
+    def get_exchange(self, ticker: str, exchange: str = None, directory: str = 'history') -> str:
+        # a stored ticker stays in its exchange
+        entry = self.get_manifest(directory).get(ticker)
+        if entry is not None:
+            return entry['exchange']
+        if exchange is None:
+            raise ValueError(f'The exchange of {ticker} is required by ShardedStorage')
+        return exchange
+
+    def write(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        # exchange: by default the stored exchange of the ticker
+        with self.lock:
+            entry = self.get_manifest(directory).get(ticker)
+            if entry is not None:
+                exchange = entry['exchange'] if exchange is None else exchange
+                self.remove(ticker, directory)
+            self.append(data, ticker, directory, exchange)
+
+    def append(self, data: np.ndarray, ticker: str, directory: str = 'history', exchange: str = None):
+        if len(ticker.encode()) > SHARD_DTYPE['ticker'].itemsize:
+            raise ValueError(f'Ticker {ticker} is longer than {SHARD_DTYPE["ticker"].itemsize} bytes')
+        if len(data) == 0:
+            return
+
+        records = np.empty(len(data), dtype=SHARD_DTYPE)
+        records['ticker'] = ticker
+        records['date'] = data['date']
+        records['close'] = data['close']
+        years = data['date'].astype('M8[Y]').astype(int) + 1970
+
+        with self.lock:
+            manifest = self.get_manifest(directory)
+            exchange = self.get_exchange(ticker, exchange, directory)
+            os.makedirs(directory + os.sep + exchange, exist_ok=True)
+            for year in np.unique(years).tolist():
+                with open(self.get_shard_path(exchange, year, directory), 'ab') as f:
+                    f.write(records[years == year].tobytes())
+
+            self.update_entry(manifest, ticker, exchange, data)
+            self.dirty.add(directory)
+
+    def remove(self, ticker: str, directory: str = 'history'):
+        # rewrites the shards of the ticker without its records
+        with self.lock:
+            for path in self.get_ticker_shards(ticker, directory):
+                records = np.fromfile(path, dtype=SHARD_DTYPE)
+                records = records[records['ticker'] != ticker.encode()]
+                atomic_write(path, 'wb', records.tofile)
+
+            del self.get_manifest(directory)[ticker]
+            self.dirty.add(directory)
+
+    def scan(self, directory: str = 'history', tickers: list = None, start: str or date = None,
+             end: str or date = None, workers: int = 8, chunk_size: int = None) -> Iterator[OrderedDict]:
+        # lazily yields one chunk of ticker -> history for each shard, in the order of exchange and year
+        # only the shards of the exchanges and years of the tickers within the date range are read,
+        # by a pool of worker processes
+        # chunk_size is not used, a chunk is a shard
+        start, end = to_date(start), to_date(end)
+        manifest = self.get_manifest(directory)
+
+        # exchange -> (first year, last year) of the tickers
+        years = {}
+        for ticker in (manifest if tickers is None else tickers):
+            entry = manifest.get(ticker)
+            if entry is None:
+                continue
+            first, last = int(entry['first'][:4]), int(entry['last'][:4])
+            low, high = years.get(entry['exchange'], (first, last))
+            years[entry['exchange']] = (min(low, first), max(high, last))
+
+        start_year = -1 if start is None else start.astype('M8[Y]').astype(int) + 1970
+        end_year = 1 << 31 if end is None else end.astype('M8[Y]').astype(int) + 1970
+        shards = [path for exchange, year, path in self.get_shards(directory)
+                  if exchange in years and years[exchange][0] <= year <= years[exchange][1]
+                  and start_year <= year <= end_year]
+
+        tickers = None if tickers is None else list(tickers)
+        if workers <= 1 or len(shards) <= 1:
+            for path in shards:
+                yield read_shard(path, tickers, start, end)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # at most two shards per worker are in flight, so that a slow consumer bounds the memory
+            futures = []
+            for path in shards:
+                futures.append(executor.submit(read_shard, path, tickers, start, end))
+                if len(futures) >= 2 * workers:
+                    yield futures.pop(0).result()
+            for future in futures:
+                yield future.result()
+
+    def import_storage(self, storage: Storage, exchanges: dict, directory: str = 'history',
+                       source_directory: str = None) -> list:
+        # copies the tickers of a per ticker storage, e.g. BinaryStorage, into shards
+        # exchanges: ticker -> exchange, e.g. from Catalogue, tickers without an exchange are skipped
+        source_directory = directory if source_directory is None else source_directory
+
+        tickers = [ticker for ticker in storage.get_tickers(source_directory) if ticker in exchanges]
+        for ticker in tickers:
+            self.write(storage.load(ticker, source_directory), ticker, directory, exchanges[ticker])
+
+        self.flush(directory)
+        return tickers
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    def __init__(self, refresh: Callable[[], None], margin: float = 60, refresh_ahead: float = 300,
+                 background: bool = True):
+        # refresh: refreshes the ID token, and calls set_token with the new one
+        # margin: seconds before the expiry, when callers refresh the token synchronously
+        # refresh_ahead: seconds before the expiry, when the token is refreshed in the background
+        self.refresh_callback = refresh
+        self.margin = margin
+        self.refresh_ahead = refresh_ahead
+        self.background = background
+
+        self.lock = threading.RLock()
+        self.timer = None
+        self.id_token = None
+        self.bearer = None
+        self.expiry = 0.0
+
+    def set_token(self, id_token: str):
+        # the token is decoded only once, when it is received
+        # jwt is imported here, so that a lazy Auth does not import it before logging in
+        import jwt
+        decoded = jwt.decode(id_token, verify=False)
+
+        with self.lock:
+            self.id_token = id_token
+            self.bearer = 'Bearer ' + id_token
+            self.expiry = float(decoded['exp'])
+            self.schedule_refresh()
+
+    def is_valid(self) -> bool:
+        return time.time() < self.expiry - self.margin
+
+    def expires_within(self, seconds: float) -> bool:
+        return time.time() > self.expiry - seconds
+
+    def get_bearer(self) -> str:
+        if not self.is_valid():
+            self.refresh()
+        return self.bearer
+
+    def refresh(self, force: bool = False):
+        with self.lock:
+            # another thread may have refreshed the token while waiting for the lock
+            if force or not self.is_valid():
+                self.refresh_callback()
+
+    def schedule_refresh(self):
+        if not self.background:
+            return
+
+        self.stop()
+        delay = max(self.expiry - self.refresh_ahead - time.time(), 0)
+        self.timer = threading.Timer(delay, self.background_refresh)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def background_refresh(self):
+        try:
+            self.refresh(force=True)
+        except Exception as e:
+            # callers fall back to refreshing synchronously
+            logger.error('Error refreshing ID token: {} - {}.'.format(type(e).__name__, str(e)))
+
+    def stop(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class TokenStore:
+    # the sessions of many accounts in one SQLite file, shared by threads and processes
+    def __init__(self, path: str = 'ft-sessions.db', timeout: float = 30.0):
+        # timeout: seconds to wait for another process, which is writing
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        # one connection shared by the threads, used under the lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            # readers do not block the writer of another process
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    email TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    refresh_token TEXT NOT NULL,
+                    id_token TEXT,
+                    updated REAL NOT NULL
+                )
+            ''')
+
+    def get(self, email: str) -> dict or None:
+        # session_id, refresh_token and the latest id_token (or None) of an account
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT session_id, refresh_token, id_token FROM sessions WHERE email = ?', (email,)).fetchone()
+        if row is None:
+            return None
+        return {'session_id': row[0], 'refresh_token': row[1], 'id_token': row[2]}
+
+    def put(self, email: str, session_id: str, refresh_token: str, id_token: str = None):
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sessions (email, session_id, refresh_token, id_token, updated) '
+                'VALUES (?, ?, ?, ?, ?)', (email, session_id, refresh_token, id_token, time.time()))
+
+    def delete(self, email: str):
+        with self.lock:
+            self.connection.execute('DELETE FROM sessions WHERE email = ?', (email,))
+
+    def get_emails(self) -> list:
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT email FROM sessions ORDER BY email')]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -13,19 +13,23 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     url='https://github.com/DainisGorbunovs/freetrade',
     packages=setuptools.find_packages(),
+    python_requires='>=3.7',
     keywords=['Freetrade', 'API', 'stock'],
     install_requires=[
         'requests',
+        'numpy',
         'pandas',
         'PyJWT',
         'python-dateutil'
     ],
+    extras_require={
+        'async': ['aiohttp']
+    },
     classifiers=[
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Development Status :: 2 - Pre-Alpha',
         'Topic :: Software Development :: Libraries :: Python Modules',
@@ -0,0 +1,72 @@
+import pytest
+
+from freetrade import API, Auth, Credentials, DataStore, Index
+from freetrade.fakeserver import FakeFreeTrade
+from freetrade.session import create_session
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    # Auth saves its session file into the working directory
+    monkeypatch.chdir(tmp_path)
+    with FakeFreeTrade(tickers=12, years=1) as fake:
+        fake.write_keys('ft-keys.json')
+        yield fake
+
+
+def make_datastore(fake: FakeFreeTrade) -> DataStore:
+    credentials = Credentials('ft-keys.json')
+    session = create_session(rate_limiter=False)
+    auth = Auth(credentials, 'test@example.com', otp_parser=lambda: '000000', session=session,
+                background_refresh=False)
+    api = API(auth, credentials.get_ft_api_host(), session=session)
+    return DataStore(api, Index(credentials, session=session))
+
+
+def test_parallel_update_reports_failing_ticker(fake, tmp_path):
+    datastore = make_datastore(fake)
+    datastore.index.get_catalogue()
+    # T1 is unknown upstream from now on
+    del fake.symbols['T1']
+
+    report = datastore.update_historical_prices(str(tmp_path / 'history'), workers=4, batch_size=1)
+
+    assert list(report['errors']) == ['T1']
+    assert sorted(report['updated']) == sorted(f'T{i}' for i in range(12) if i != 1)
+    assert all(rows > 0 for rows in report['updated'].values())
+    assert not datastore.storage.exists('T1', str(tmp_path / 'history'))
+
+
+def test_batch_is_split_into_ticker_histories(fake):
+    datastore = make_datastore(fake)
+    datastore.api.auth.ensure_authenticated()
+    tickers = ['T1', 'T2', 'T4', 'T5']
+    requests = fake.requests
+
+    histories = datastore.api.get_ticker_histories_iextrading(tickers, '1m', output='array')
+
+    assert fake.requests - requests == 1
+    assert list(histories) == tickers
+    for ticker in tickers:
+        dates, prices = fake.get_prices(ticker, fake.get_range_start('1m'))
+        assert histories[ticker]['date'].tolist() == dates.tolist()
+        assert histories[ticker]['close'].tolist() == prices.tolist()
+
+
+def test_batch_update_reports_missing_symbols(fake, tmp_path):
+    datastore = make_datastore(fake)
+    datastore.index.get_catalogue()
+    del fake.symbols['T1']
+
+    batch = str(tmp_path / 'batch')
+    single = str(tmp_path / 'single')
+    batch_report = datastore.update_historical_prices(batch, workers=4)
+    single_report = datastore.update_historical_prices(single, workers=4, batch_size=1)
+
+    # the symbol missing from the batch response is an error, as with its own request
+    assert list(batch_report['errors']) == list(single_report['errors']) == ['T1']
+    assert not datastore.storage.exists('T1', batch)
+    assert batch_report['updated'] == single_report['updated']
+    assert datastore.storage.get_tickers(batch) == datastore.storage.get_tickers(single)
+    for ticker in datastore.storage.get_tickers(batch):
+        assert datastore.storage.load(ticker, batch).tolist() == datastore.storage.load(ticker, single).tolist()
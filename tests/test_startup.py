@@ -0,0 +1,26 @@
+from freetrade import FreeTrade
+from freetrade.benchmark import measure, measure_import
+from freetrade.fakeserver import FakeFreeTrade
+
+# generous bounds, which only a regression to eager imports or logging in would exceed
+IMPORT_SECONDS = 0.1
+INIT_SECONDS = 0.5
+
+
+def test_import_is_fast_and_loads_no_heavy_modules():
+    result = measure_import('import freetrade')
+
+    assert result['modules'] == []
+    assert result['min'] < IMPORT_SECONDS
+
+
+def test_freetrade_init_is_fast_and_makes_no_requests(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with FakeFreeTrade(tickers=1) as fake:
+        fake.write_keys('ft-keys.json')
+        result = measure('FreeTrade.__init__', 0, lambda: FreeTrade('test@example.com', 'ft-keys.json'))
+        ft = FreeTrade('test@example.com', 'ft-keys.json')
+
+        assert fake.requests == 0
+        assert ft.auth is not None and not ft.auth.authenticated
+        assert result['min'] < INIT_SECONDS